@@ -0,0 +1,116 @@
+# app/bot/dispatcher.py
+# -*- coding: utf-8 -*-
+
+import os
+import asyncio
+from collections import deque
+from core.logging import log_error, log_info
+
+# تعداد worker همزمان و سقف آپدیت‌های در صف (بیشتر از این => 503 تا تلگرام بعدا دوباره بفرسته)
+WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "5000"))
+DRAIN_TIMEOUT_SEC = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT_SEC", "30"))
+
+
+def update_chat_id(update: dict):
+    """chat_id آپدیت؛ ترتیب پردازش برای هر چت حفظ میشه"""
+    cb = update.get("callback_query")
+    if isinstance(cb, dict):
+        chat = (cb.get("message") or {}).get("chat") or {}
+        if chat.get("id") is not None:
+            return str(chat["id"])
+        user = cb.get("from") or {}
+        if user.get("id") is not None:
+            return str(user["id"])
+    for k in ("message", "edited_message", "channel_post", "my_chat_member"):
+        chat = (update.get(k) or {}).get("chat") or {}
+        if chat.get("id") is not None:
+            return str(chat["id"])
+    return None
+
+
+class UpdateDispatcher:
+    """
+    هر چت یک صف (deque) داره؛ صف ready فقط کلید چت‌هایی رو نگه می‌داره که کار دارن.
+    هر چت در هر لحظه فقط دست یک worker است => ترتیب برای هر چت ثابت،
+    ولی چت‌های مختلف همزمان پردازش میشن.
+    """
+
+    def __init__(self, handler, workers: int = WORKERS, max_pending: int = MAX_PENDING):
+        self._handler = handler
+        self._workers_n = workers
+        self._max_pending = max_pending
+        self._lanes: dict[str, deque] = {}
+        self._ready: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._pending = 0
+        self._idle: asyncio.Event | None = None
+        self._accepting = False
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        if self._workers:
+            return
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._accepting = True
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self._workers_n)]
+
+    def has_capacity(self) -> bool:
+        return self._accepting and self._pending < self._max_pending
+
+    def submit(self, update: dict) -> bool:
+        if not self.has_capacity():
+            return False
+        key = update_chat_id(update) or "_"
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = deque()
+            # چت تازه وارد صف ready میشه؛ اگر lane وجود داشت یعنی الان در صف یا در دست worker است
+            self._ready.put_nowait(key)
+        lane.append(update)
+        self._pending += 1
+        self._idle.clear()
+        return True
+
+    async def _worker(self, n: int):
+        while True:
+            key = await self._ready.get()
+            lane = self._lanes[key]
+            update = lane.popleft()
+            try:
+                await self._handler(update)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_error(f"Update {update.get('update_id')} ERROR: {e}")
+            finally:
+                self._pending -= 1
+                if lane:
+                    # یک آپدیت در هر نوبت تا چت‌های شلوغ بقیه رو گرسنه نذارن
+                    self._ready.put_nowait(key)
+                else:
+                    del self._lanes[key]
+                if self._pending == 0:
+                    self._idle.set()
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT_SEC):
+        """ورودی جدید قبول نمیشه، کارهای در صف تموم میشن، بعد workerها بسته میشن"""
+        self._accepting = False
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            log_error(f"Webhook drain timeout: {self._pending} updates dropped")
+        for t in self._workers:
+            t.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._lanes.clear()
+        self._pending = 0
+        log_info("Webhook dispatcher stopped")
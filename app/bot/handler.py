@@ -1,7 +1,7 @@
 # app/bot/handler.py
 # -*- coding: utf-8 -*-
 
-from cachetools import TTLCache
+import asyncio
 
 from bot.helpers import send_message, send_buttons, send_reply_keyboard
 from bot.keyboards import main_keyboard, team_inline_keyboard
@@ -16,8 +16,10 @@ from core.tasks import (
     group_tasks_by_date,
 )
 from core.messages import get_welcome_message
+from core.dedupe import UpdateDeduper
 
-processed_updates = TTLCache(maxsize=20000, ttl=600)
+# مشترک بین workerها و بعد از restart (SQLite) با جلوی حافظه‌ای
+processed_updates = UpdateDeduper()
 
 def _action_buttons(task_id: str):
     return [
@@ -74,13 +76,19 @@ async def send_not_done(chat_id):
     for t in tasks:
         await send_buttons(chat_id, format_task_block(t, include_delay=True), _action_buttons(t["task_id"]))
 
-async def process_update(update: dict):
-    upd_id = update.get("update_id")
-    if upd_id is not None:
-        if upd_id in processed_updates:
-            return
-        processed_updates[upd_id] = True
+async def claim_update(upd_id) -> bool:
+    """True اگر این update_id اولین بار است که دیده میشه (تکراری‌های تلگرام رد میشن)"""
+    if upd_id is None:
+        return True
+    if processed_updates.seen(upd_id):
+        return False
+    return await asyncio.to_thread(processed_updates.claim, upd_id)
 
+async def release_update(upd_id):
+    # اگر صف نپذیرفت، تلاش بعدی تلگرام نباید تکراری حساب بشه
+    await asyncio.to_thread(processed_updates.release, upd_id)
+
+async def process_update(update: dict):
     # ----- Inline callbacks -----
     if "callback_query" in update:
         cb = update["callback_query"]
@@ -2,28 +2,222 @@
 # -*- coding: utf-8 -*-
 
 import os
+import json
+import time
+import asyncio
+from collections import deque
 import aiohttp
-from core.logging import log_error
+from cachetools import TTLCache
+from core.logging import log_error, log_info
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+API_BASE = f"https://api.telegram.org/bot{BOT_TOKEN}"
 
-async def _post(method: str, payload: dict):
+# ---- تنظیمات connection pool به api.telegram.org ----
+HTTP_POOL_LIMIT = int(os.getenv("TG_POOL_LIMIT", "64"))
+HTTP_KEEPALIVE_SEC = int(os.getenv("TG_KEEPALIVE_SEC", "60"))
+HTTP_DNS_TTL_SEC = int(os.getenv("TG_DNS_TTL_SEC", "600"))
+HTTP_TIMEOUT_SEC = int(os.getenv("TG_TIMEOUT_SEC", "20"))
+
+# ---- محدودیت‌های ارسال تلگرام (سراسری ~30 پیام/ثانیه، هر چت ~1 پیام/ثانیه) ----
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))
+GLOBAL_BURST = float(os.getenv("TG_GLOBAL_BURST", "25"))
+CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "5"))
+MAX_429_RETRIES = int(os.getenv("TG_MAX_429_RETRIES", "5"))
+
+_session: aiohttp.ClientSession | None = None
+
+
+async def start_http():
+    """یک session ثابت برای کل عمر برنامه (در lifespan ساخته می‌شود)"""
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        ttl_dns_cache=HTTP_DNS_TTL_SEC,
+        keepalive_timeout=HTTP_KEEPALIVE_SEC,
+    )
+    _session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SEC),
+    )
+    return _session
+
+
+async def close_http():
+    global _session
+    await sender.drain()
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _get_session():
+    # اگر بیرون از lifespan صدا زده شد (مثلا اسکریپت دستی)، lazy می‌سازیم
+    if _session is None or _session.closed:
+        return await start_http()
+    return _session
+
+
+async def _post_raw(method: str, payload: dict):
+    """
+    خروجی: (ok, retry_after) — retry_after فقط برای پاسخ 429 مقدار دارد
+    """
     if not BOT_TOKEN:
         log_error("BOT_TOKEN not set")
-        return False
+        return False, None
 
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/{method}"
+    url = f"{API_BASE}/{method}"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, timeout=20) as r:
-                if r.status != 200:
-                    log_error(f"{method} failed: {await r.text()}")
-                    return False
-                return True
+        session = await _get_session()
+        async with session.post(url, json=payload) as r:
+            if r.status == 200:
+                return True, None
+            body = await r.text()
+            if r.status == 429:
+                retry_after = _parse_retry_after(body, r.headers.get("Retry-After"))
+                return False, retry_after
+            log_error(f"{method} failed: {body}")
+            return False, None
     except Exception as e:
         log_error(f"{method} ERROR: {e}")
+        return False, None
+
+
+def _parse_retry_after(body: str, header: str | None) -> float:
+    try:
+        data = json.loads(body)
+        return float(data["parameters"]["retry_after"])
+    except Exception:
+        pass
+    try:
+        return float(header)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds: float):
+        """بعد از 429: تا این مدت هیچ توکنی داده نمیشه"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            wait = self.paused_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _ChatLane:
+    def __init__(self, bucket: TokenBucket):
+        self.items = deque()
+        self.bucket = bucket
+        self.task: asyncio.Task | None = None
+
+
+class SendQueue:
+    """
+    صف ارسال: هر چت یک lane با ترتیب ثابت (FIFO) دارد،
+    lane‌ها همزمان اجرا می‌شوند و همه از یک token bucket سراسری رد می‌شوند.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._lanes: dict[str, _ChatLane] = {}
+        # bucket هر چت بعد از خالی شدن lane هم می‌مونه (وگرنه هر پیام بعدی burst کامل می‌گرفت)؛
+        # بعد از capacity/rate ثانیه بی‌استفاده‌بودن، bucket به هر حال پر است و حذفش بی‌خطره
+        self._buckets = TTLCache(maxsize=10000, ttl=max(60.0, CHAT_BURST / CHAT_RATE))
+
+    def _chat_bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(CHAT_RATE, CHAT_BURST)
+        # دوباره گذاشتن => TTL از آخرین استفاده حساب میشه
+        self._buckets[key] = bucket
+        return bucket
+
+    def submit(self, chat_id, method: str, payload: dict) -> asyncio.Future:
+        key = str(chat_id)
+        fut = asyncio.get_running_loop().create_future()
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _ChatLane(self._chat_bucket(key))
+        lane.items.append((method, payload, fut))
+        if lane.task is None:
+            lane.task = asyncio.create_task(self._run_lane(key, lane))
+        return fut
+
+    async def _run_lane(self, key: str, lane: _ChatLane):
+        try:
+            while lane.items:
+                method, payload, fut = lane.items[0]
+                self._buckets[key] = lane.bucket  # زنده نگه داشتن bucket در lane‌های طولانی
+                try:
+                    ok = await self._deliver(lane, method, payload)
+                except Exception as e:
+                    log_error(f"{method} ERROR: {e}")
+                    ok = False
+                lane.items.popleft()
+                if not fut.done():
+                    fut.set_result(ok)
+        finally:
+            # اگر lane کنسل شد، منتظرها رو آزاد می‌کنیم
+            while lane.items:
+                _, _, fut = lane.items.popleft()
+                if not fut.done():
+                    fut.set_result(False)
+            if self._lanes.get(key) is lane:
+                del self._lanes[key]
+
+    async def _deliver(self, lane: _ChatLane, method: str, payload: dict):
+        for _ in range(MAX_429_RETRIES + 1):
+            await lane.bucket.acquire()
+            await self._global.acquire()
+            ok, retry_after = await _post_raw(method, payload)
+            if retry_after is None:
+                return ok
+            log_info(f"{method} 429 chat={payload.get('chat_id')} retry_after={retry_after}")
+            # محدودیت flood تلگرام برای کل باته: همه‌ی laneها صبر می‌کنن
+            self._global.pause(retry_after)
+            await asyncio.sleep(retry_after)
+        log_error(f"{method} gave up after {MAX_429_RETRIES} retries chat={payload.get('chat_id')}")
         return False
 
+    async def drain(self, timeout: float = 30):
+        tasks = [lane.task for lane in self._lanes.values() if lane.task]
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for t in pending:
+            t.cancel()
+
+
+sender = SendQueue()
+
+
+async def _post(method: str, payload: dict):
+    return await sender.submit(payload.get("chat_id"), method, payload)
+
 async def send_message(chat_id, text):
     return await _post("sendMessage", {
         "chat_id": chat_id,
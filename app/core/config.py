@@ -6,3 +6,7 @@ import os
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 GOOGLE_API_URL = os.getenv("GOOGLE_API_URL").rstrip("/") if os.getenv("GOOGLE_API_URL") else ""
 CACHE_TTL = int(os.getenv("CACHE_TTL", "60"))
+# stale-while-revalidate: تا این چند ثانیه بعد از انقضا، داده‌ی قدیمی فوری برگردونده میشه و در پس‌زمینه تازه میشه
+CACHE_STALE_WHILE_REVALIDATE = int(os.getenv("CACHE_STALE_WHILE_REVALIDATE", "600"))
+# stale-if-error: اگر Apps Script خطا داد، داده‌ی قدیمی‌تر از این (ثانیه بعد از انقضا) برگردونده نمیشه
+CACHE_STALE_IF_ERROR = int(os.getenv("CACHE_STALE_IF_ERROR", "86400"))
@@ -0,0 +1,17 @@
+# app/core/db.py
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+from pathlib import Path
+
+# دیتابیس محلی (کش شیت‌ها، state کاربرها و ...) کنار states.json
+DB_PATH = Path(os.getenv("DB_PATH", "app/db/bot.sqlite3"))
+
+
+def connect() -> sqlite3.Connection:
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,90 @@
+# app/core/dedupe.py
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+from cachetools import TTLCache
+
+from core.db import connect
+from core.logging import log_error
+
+# update_id تا این مدت نگه داشته میشه (تلگرام تا ۲۴ ساعت دوباره می‌فرسته)
+DEDUPE_WINDOW_SEC = int(os.getenv("DEDUPE_WINDOW_SEC", "86400"))
+DEDUPE_MEMORY_SIZE = int(os.getenv("DEDUPE_MEMORY_SIZE", "20000"))
+# هر چند claim یکبار ردیف‌های قدیمی پاک میشن
+PRUNE_EVERY = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id INTEGER PRIMARY KEY,
+    seen_at   REAL NOT NULL
+)
+"""
+
+
+class UpdateDeduper:
+    """
+    حذف update تکراری، مشترک بین workerها و بعد از restart:
+    جلوی کار یک TTLCache در حافظه، پشتش SQLite با پنجره‌ی لغزان.
+    claim/release همزمان (sync) هستن؛ از event loop با to_thread صدا زده میشن.
+    """
+
+    def __init__(self, window: int = DEDUPE_WINDOW_SEC, memory_size: int = DEDUPE_MEMORY_SIZE):
+        self.window = window
+        self._memory = TTLCache(maxsize=memory_size, ttl=window)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._claims = 0
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = connect()
+            self._conn.execute(_SCHEMA)
+        return self._conn
+
+    def seen(self, update_id: int) -> bool:
+        """فقط حافظه؛ برای رد سریع تکراری‌ها بدون رفتن به دیسک"""
+        return update_id in self._memory
+
+    def claim(self, update_id: int) -> bool:
+        """True فقط برای اولین worker/پروسه‌ای که این update_id رو ثبت کنه"""
+        if update_id in self._memory:
+            return False
+        with self._lock:
+            try:
+                conn = self._db()
+                now = time.time()
+                with conn:
+                    cur = conn.execute(
+                        "INSERT OR IGNORE INTO processed_updates (update_id, seen_at) VALUES (?, ?)",
+                        (update_id, now),
+                    )
+                    claimed = cur.rowcount == 1
+                    self._claims += 1
+                    if self._claims % PRUNE_EVERY == 0:
+                        conn.execute("DELETE FROM processed_updates WHERE seen_at < ?", (now - self.window,))
+            except Exception as e:
+                # اگر دیسک در دسترس نبود، فقط به حافظه تکیه می‌کنیم
+                log_error(f"dedupe claim ERROR: {e}")
+                claimed = True
+            if claimed:
+                # رد شده‌ها رو حفظ نمی‌کنیم؛ شاید صاحبشون release کنه
+                self._memory[update_id] = True
+        return claimed
+
+    def release(self, update_id: int):
+        """وقتی update پذیرفته نشد، تا تلاش بعدی تلگرام تکراری حساب نشه"""
+        with self._lock:
+            self._memory.pop(update_id, None)
+            try:
+                with self._db() as conn:
+                    conn.execute("DELETE FROM processed_updates WHERE update_id = ?", (update_id,))
+            except Exception as e:
+                log_error(f"dedupe release ERROR: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,277 @@
+# app/core/lease.py
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+
+from core.db import connect
+from core.logging import log_error, log_info
+
+# ---- قفل بین پروسه‌ها/workerها برای jobها (فقط یک نفر اجرا کنه) ----
+LEASE_BACKEND = os.getenv("LEASE_BACKEND", "sqlite").strip().lower()
+LEASE_TTL_SEC = float(os.getenv("LEASE_TTL_SEC", "120"))
+
+# شناسه‌ی این پروسه؛ lease فقط توسط صاحبش تمدید/آزاد میشه
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaseBackend(ABC):
+    """
+    رابط backend؛ متدها sync هستن و از event loop با to_thread صدا زده میشن.
+    برای Redis/Postgres و ... همین متدها پیاده میشن.
+    process: شناسه‌ی پروسه (OWNER_ID)؛ برای فهمیدن اینکه آخرین بار کدام پروسه job رو اجرا کرد.
+    """
+
+    @abstractmethod
+    def acquire(self, name: str, owner: str, process: str, ttl: float):
+        """خروجی: (held, پروسه‌ی قبلی یا None)"""
+
+    @abstractmethod
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        ...
+
+    @abstractmethod
+    def release(self, name: str, owner: str):
+        ...
+
+    @abstractmethod
+    def claim_run(self, name: str, run_key: str) -> bool:
+        """True فقط برای اولین اجرای (name, run_key)؛ مثلا job روزانه برای یک تاریخ"""
+
+    @abstractmethod
+    def release_run(self, name: str, run_key: str):
+        """اجرای ناموفق: (name, run_key) دوباره قابل claim میشه"""
+
+
+class MemoryLeaseBackend(LeaseBackend):
+    """فقط داخل یک پروسه (توسعه/تست)"""
+
+    def __init__(self):
+        self._leases = {}  # name -> (owner, expires_at, process)
+        self._runs = set()
+        self._lock = threading.Lock()
+
+    def acquire(self, name, owner, process, ttl):
+        now = time.time()
+        with self._lock:
+            cur = self._leases.get(name)
+            if cur and cur[0] != owner and cur[1] > now:
+                return False, cur[2]
+            self._leases[name] = (owner, now + ttl, process)
+            return True, cur[2] if cur else None
+
+    def renew(self, name, owner, ttl):
+        with self._lock:
+            cur = self._leases.get(name)
+            if not cur or cur[0] != owner:
+                return False
+            self._leases[name] = (owner, time.time() + ttl, cur[2])
+            return True
+
+    def release(self, name, owner):
+        with self._lock:
+            cur = self._leases.get(name)
+            if cur and cur[0] == owner:
+                # ردیف می‌مونه (منقضی) تا پروسه‌ی آخر معلوم باشه
+                self._leases[name] = (owner, 0.0, cur[2])
+
+    def claim_run(self, name, run_key):
+        with self._lock:
+            if (name, run_key) in self._runs:
+                return False
+            self._runs.add((name, run_key))
+            return True
+
+    def release_run(self, name, run_key):
+        with self._lock:
+            self._runs.discard((name, run_key))
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name       TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    process    TEXT
+);
+CREATE TABLE IF NOT EXISTS job_runs (
+    name    TEXT NOT NULL,
+    run_key TEXT NOT NULL,
+    owner   TEXT NOT NULL,
+    ran_at  REAL NOT NULL,
+    PRIMARY KEY (name, run_key)
+);
+"""
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """مشترک بین همه‌ی workerهای روی یک دیسک (همان DB_PATH)"""
+
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = connect()
+            self._conn.executescript(_SCHEMA)
+            try:
+                # DBهایی که قبل از ستون process ساخته شدن
+                self._conn.execute("ALTER TABLE leases ADD COLUMN process TEXT")
+            except sqlite3.OperationalError:
+                pass
+        return self._conn
+
+    def acquire(self, name, owner, process, ttl):
+        now = time.time()
+        with self._lock, self._db() as conn:
+            # خواندن صاحب قبلی و گرفتن lease در یک تراکنش
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT owner, expires_at, process FROM leases WHERE name = ?", (name,)).fetchone()
+            previous = row[2] if row else None
+            if row and row[0] != owner and row[1] >= now:
+                return False, previous
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires_at, process) VALUES (?, ?, ?, ?)",
+                (name, owner, now + ttl, process),
+            )
+            return True, previous
+
+    def renew(self, name, owner, ttl):
+        with self._lock, self._db() as conn:
+            cur = conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE name = ? AND owner = ?",
+                (time.time() + ttl, name, owner),
+            )
+            return cur.rowcount == 1
+
+    def release(self, name, owner):
+        with self._lock, self._db() as conn:
+            # ردیف می‌مونه (منقضی) تا پروسه‌ی آخر معلوم باشه
+            conn.execute("UPDATE leases SET expires_at = 0 WHERE name = ? AND owner = ?", (name, owner))
+
+    def claim_run(self, name, run_key):
+        with self._lock, self._db() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO job_runs (name, run_key, owner, ran_at) VALUES (?, ?, ?, ?)",
+                (name, run_key, OWNER_ID, time.time()),
+            )
+            return cur.rowcount == 1
+
+    def release_run(self, name, run_key):
+        with self._lock, self._db() as conn:
+            conn.execute("DELETE FROM job_runs WHERE name = ? AND run_key = ?", (name, run_key))
+
+
+_BACKENDS = {
+    "sqlite": SQLiteLeaseBackend,
+    "memory": MemoryLeaseBackend,
+}
+
+_backend: LeaseBackend | None = None
+
+
+def get_backend() -> LeaseBackend:
+    global _backend
+    if _backend is None:
+        factory = _BACKENDS.get(LEASE_BACKEND)
+        if factory is None:
+            log_error(f"Unknown LEASE_BACKEND={LEASE_BACKEND}, using sqlite")
+            factory = SQLiteLeaseBackend
+        _backend = factory()
+    return _backend
+
+
+def set_backend(backend: LeaseBackend):
+    """برای backend بیرونی (Redis و ...)"""
+    global _backend
+    _backend = backend
+
+
+async def _renew_loop(backend: LeaseBackend, name: str, owner: str, ttl: float):
+    while True:
+        await asyncio.sleep(ttl / 3)
+        try:
+            ok = await asyncio.to_thread(backend.renew, name, owner, ttl)
+        except Exception as e:
+            log_error(f"lease renew {name} ERROR: {e}")
+            ok = False
+        if not ok:
+            log_error(f"lease {name} lost")
+            return
+
+
+class Lease:
+    """
+    نتیجه‌ی lease(): در شرط‌ها مثل bool رفتار می‌کنه.
+    taken_over: آخرین اجرای قبلی مال پروسه‌ی دیگری بود => کش محلی ممکنه کهنه باشه
+    """
+
+    def __init__(self, held: bool, previous: str | None = None):
+        self.held = held
+        self.previous = previous
+
+    def __bool__(self):
+        return self.held
+
+    @property
+    def taken_over(self) -> bool:
+        return self.held and self.previous is not None and self.previous != OWNER_ID
+
+
+@asynccontextmanager
+async def lease(name: str, ttl: float = LEASE_TTL_SEC):
+    """
+    async with lease("reminders") as held:
+        if held: ...
+    تا وقتی بلوک در حال اجراست lease خودکار تمدید میشه. اگر backend در دسترس نبود، held=False.
+    """
+    backend = get_backend()
+    # هر بار گرفتن یک صاحب جدا => داخل همین پروسه هم دو اجرای همزمان ممکن نیست
+    owner = f"{OWNER_ID}:{uuid.uuid4().hex[:8]}"
+    try:
+        held, previous = await asyncio.to_thread(backend.acquire, name, owner, OWNER_ID, ttl)
+    except Exception as e:
+        log_error(f"lease acquire {name} ERROR: {e}")
+        held, previous = False, None
+
+    if not held:
+        yield Lease(False, previous)
+        return
+
+    renewer = asyncio.create_task(_renew_loop(backend, name, owner, ttl))
+    try:
+        yield Lease(True, previous)
+    finally:
+        renewer.cancel()
+        try:
+            await asyncio.to_thread(backend.release, name, owner)
+        except Exception as e:
+            log_error(f"lease release {name} ERROR: {e}")
+
+
+async def claim_run(name: str, run_key: str) -> bool:
+    """اجرای یکباره: مثلا claim_run("daily", "2024-05-01")"""
+    try:
+        ok = await asyncio.to_thread(get_backend().claim_run, name, run_key)
+    except Exception as e:
+        log_error(f"claim_run {name}/{run_key} ERROR: {e}")
+        return False
+    if not ok:
+        log_info(f"{name} already ran for {run_key}, skipping")
+    return ok
+
+
+async def release_run(name: str, run_key: str):
+    """اجرای ناموفق: تلاش بعدی (catch-up یا /run/*) دوباره اجرا می‌کنه"""
+    try:
+        await asyncio.to_thread(get_backend().release_run, name, run_key)
+    except Exception as e:
+        log_error(f"release_run {name}/{run_key} ERROR: {e}")
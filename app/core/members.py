@@ -1,7 +1,7 @@
 # app/core/members.py
 # -*- coding: utf-8 -*-
 
-from core.sheets import get_sheet, append_row, update_cell, invalidate
+from core.sheets import get_sheet, append_row, update_cell, invalidate, sheet_version
 
 MEMBERS_SHEET = "members"
 
@@ -11,26 +11,61 @@ def clean(s):
 def normalize_team(s: str) -> str:
     return clean(s).lower().replace("ai production", "aiproduction").replace(" ", "")
 
-async def find_member(chat_id):
+def _member_from_row(i: int, row: list) -> dict:
+    return {
+        "row": i,
+        "chat_id": clean(row[0]) if len(row) > 0 else "",
+        "name": clean(row[1]) if len(row) > 1 else "",
+        "username": clean(row[2]) if len(row) > 2 else "",
+        "team": clean(row[3]) if len(row) > 3 else "",
+        "customname": clean(row[4]) if len(row) > 4 else "",
+        "welcomed": (clean(row[5]).lower() == "yes") if len(row) > 5 else False
+    }
+
+_TEAM_FIELDS = ("chat_id", "name", "username", "team", "customname")
+
+
+class MemberDirectory:
+    """
+    ایندکس اعضا که یک بار برای هر نسخه‌ی شیت members ساخته میشه:
+    - by_chat_id: chat_id -> عضو (اولین ردیف، مثل جستجوی خطی قبلی)
+    - by_team: تیم نرمال‌شده -> اعضا (گروه مدیرها با تیم "ALL" هم همینجاست)
+    """
+
+    def __init__(self, rows: list):
+        self.by_chat_id = {}
+        self.by_team = {}
+        for i, row in enumerate(rows[1:], start=2):
+            m = _member_from_row(i, row)
+            self.by_chat_id.setdefault(m["chat_id"], m)
+            team = normalize_team(row[3]) if len(row) > 3 else ""
+            self.by_team.setdefault(team, []).append({k: m[k] for k in _TEAM_FIELDS})
+
+    def find(self, chat_id):
+        return self.by_chat_id.get(str(chat_id).strip())
+
+    def team(self, team: str):
+        return self.by_team.get(normalize_team(team), [])
+
+_EMPTY_DIRECTORY = MemberDirectory([])
+
+# کش ایندکس اعضا، کلید: نسخه‌ی شیت members
+_directory = {"version": None, "value": _EMPTY_DIRECTORY}
+
+async def load_member_directory() -> MemberDirectory:
     rows = await get_sheet(MEMBERS_SHEET)
     if not rows or len(rows) < 2:
-        return None
-
-    cid = str(chat_id).strip()
-
-    for i, row in enumerate(rows[1:], start=2):
-        row_cid = clean(row[0]) if len(row) > 0 else ""
-        if row_cid == cid:
-            return {
-                "row": i,
-                "chat_id": row_cid,
-                "name": clean(row[1]) if len(row) > 1 else "",
-                "username": clean(row[2]) if len(row) > 2 else "",
-                "team": clean(row[3]) if len(row) > 3 else "",
-                "customname": clean(row[4]) if len(row) > 4 else "",
-                "welcomed": (clean(row[5]).lower() == "yes") if len(row) > 5 else False
-            }
-    return None
+        return _EMPTY_DIRECTORY
+
+    version = sheet_version(MEMBERS_SHEET)
+    if _directory["version"] != version:
+        _directory["value"] = MemberDirectory(rows)
+        _directory["version"] = version
+    return _directory["value"]
+
+async def find_member(chat_id):
+    m = (await load_member_directory()).find(chat_id)
+    return dict(m) if m else None
 
 async def save_or_add_member(chat_id, name=None, username=None, team=None):
     member = await find_member(chat_id)
@@ -63,20 +98,4 @@ async def set_member_welcomed(chat_id):
     return ok
 
 async def get_members_by_team(team: str):
-    rows = await get_sheet(MEMBERS_SHEET)
-    if not rows or len(rows) < 2:
-        return []
-
-    t = normalize_team(team)
-    out = []
-    for row in rows[1:]:
-        row_team = normalize_team(row[3]) if len(row) > 3 else ""
-        if row_team == t:
-            out.append({
-                "chat_id": clean(row[0]) if len(row) > 0 else "",
-                "name": clean(row[1]) if len(row) > 1 else "",
-                "username": clean(row[2]) if len(row) > 2 else "",
-                "team": clean(row[3]) if len(row) > 3 else "",
-                "customname": clean(row[4]) if len(row) > 4 else "",
-            })
-    return out
+    return [dict(m) for m in (await load_member_directory()).team(team)]
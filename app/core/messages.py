@@ -1,16 +1,16 @@
 # app/core/messages.py
 # -*- coding: utf-8 -*-
 
+import re
 import random
-from core.sheets import get_sheet
+from core.sheets import get_sheet, sheet_version
 from core.logging import log_error
 
 MESSAGES_SHEET = "Messages"
 
-async def load_messages():
-    rows = await get_sheet(MESSAGES_SHEET)
-    if not rows or len(rows) < 2:
-        return []
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+def _messages_from_rows(rows):
     body = rows[1:]
     out = []
     for row in body:
@@ -20,16 +20,82 @@ async def load_messages():
             out.append({"type": t, "text": txt})
     return out
 
+async def load_messages():
+    rows = await get_sheet(MESSAGES_SHEET)
+    if not rows or len(rows) < 2:
+        return []
+    return _messages_from_rows(rows)
+
+
+class MessageTemplate:
+    """
+    متن پیام که یک بار به تکه‌ها شکسته شده: خانه‌های زوج متن ثابت و خانه‌های فرد اسم placeholder.
+    render در یک پاس انجام میشه؛ placeholderی که مقدار نداره دست‌نخورده می‌مونه.
+    """
+
+    __slots__ = ("text", "parts")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.parts = _PLACEHOLDER.split(text)
+
+    def render(self, **kwargs) -> str:
+        if not kwargs:
+            return self.text
+        parts = self.parts
+        out = []
+        for i, p in enumerate(parts):
+            if i % 2 == 0:
+                out.append(p)
+            elif p in kwargs:
+                out.append(str(kwargs[p]))
+            else:
+                out.append("{" + p + "}")
+        return "".join(out)
+
+    def render_many(self, common: dict, per_recipient: list[dict]) -> list[str]:
+        """یک قالب برای چند گیرنده: فیلدهای مشترک یک بار جایگذاری میشن"""
+        partial = MessageTemplate(self.render(**common)) if common else self
+        return [partial.render(**kw) for kw in per_recipient]
+
+
+class MessageCatalogue:
+    def __init__(self, messages: list):
+        self.by_type = {}
+        for m in messages:
+            self.by_type.setdefault(m["type"], []).append(MessageTemplate(m["text"]))
+
+    def pick(self, msg_type):
+        pool = self.by_type.get(msg_type)
+        if not pool:
+            log_error(f"No messages for type {msg_type}")
+            return None
+        return random.choice(pool)
+
+_EMPTY_CATALOGUE = MessageCatalogue([])
+
+# کش قالب‌های کامپایل‌شده، کلید: نسخه‌ی شیت Messages
+_catalogue = {"version": None, "value": _EMPTY_CATALOGUE}
+
+async def load_catalogue() -> MessageCatalogue:
+    rows = await get_sheet(MESSAGES_SHEET)
+    if not rows or len(rows) < 2:
+        return _EMPTY_CATALOGUE
+
+    version = sheet_version(MESSAGES_SHEET)
+    if _catalogue["version"] != version:
+        _catalogue["value"] = MessageCatalogue(_messages_from_rows(rows))
+        _catalogue["version"] = version
+    return _catalogue["value"]
+
+async def get_message_template(msg_type):
+    return (await load_catalogue()).pick(msg_type)
+
 async def get_random_message(msg_type, **kwargs):
-    msgs = await load_messages()
-    pool = [m for m in msgs if m["type"] == msg_type]
-    if not pool:
-        log_error(f"No messages for type {msg_type}")
+    tpl = await get_message_template(msg_type)
+    if tpl is None:
         return "—"
-    text = random.choice(pool)["text"]
-    for k, v in kwargs.items():
-        text = text.replace(f"{{{k}}}", str(v))
-    return text
+    return tpl.render(**kwargs)
 
 async def get_welcome_message(name):
     return await get_random_message("welcome", name=name)
@@ -2,25 +2,468 @@
 # -*- coding: utf-8 -*-
 
 import os
+import json
+import time
+import asyncio
+import hashlib
 import aiohttp
-from tenacity import retry, stop_after_attempt, wait_exponential
-from cachetools import TTLCache
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
-from core.config import CACHE_TTL
-from core.logging import log_error
+from core.config import CACHE_TTL, CACHE_STALE_WHILE_REVALIDATE, CACHE_STALE_IF_ERROR
+from core.logging import log_error, log_info
+from core.snapshots import save_snapshot, touch_snapshot, load_snapshots
 
 API = os.getenv("GOOGLE_API_URL", "").rstrip("/")
-cache = TTLCache(maxsize=200, ttl=CACHE_TTL)
+
+
+class _Entry:
+    __slots__ = ("rows", "fetched_at", "expired", "etag", "restored")
+
+    def __init__(self, rows: list, etag: str | None = None):
+        self.rows = rows
+        self.fetched_at = time.monotonic()
+        self.expired = False  # با invalidate: دیگه fresh/SWR حساب نمیشه ولی برای stale-if-error می‌مونه
+        self.etag = etag  # hash محتوای شیت از طرف Apps Script، برای درخواست شرطی
+        self.restored = False  # از snapshot دیسک آمده و هنوز revalidate نشده
+
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+
+cache: dict[str, _Entry] = {}
+
+# ---- سقف timeout هر عملیات (ثانیه)؛ timeout واقعی بر اساس latency اخیر تنظیم میشه ----
+TIMEOUTS = {
+    "get_sheet": 25,
+    "get_sheet_not_modified": 25,  # فقط آمار؛ جواب‌های کوچک not_modified timeout دانلود کامل رو کم نکنن
+    "update_cell": 25,
+    "append_row": 25,
+    "sync_tasks": 40,
+    "batch_update": 40,
+    "delta": 25,
+}
+BATCH_MAX = int(os.getenv("SHEETS_BATCH_MAX", "200"))  # حداکثر سلول در هر درخواست batch_update
+POOL_LIMIT = int(os.getenv("SHEETS_POOL_LIMIT", "16"))
+KEEPALIVE_SEC = int(os.getenv("SHEETS_KEEPALIVE_SEC", "60"))
+DELTA_SYNC = os.getenv("SHEETS_DELTA_SYNC", "1") == "1"
+DELTA_BLOCK = int(os.getenv("SHEETS_DELTA_BLOCK", "64"))  # تعداد ردیف در هر بلوک fingerprint
+
+TIMEOUT_FLOOR_SEC = float(os.getenv("SHEETS_TIMEOUT_FLOOR_SEC", "8"))
+RETRY_ATTEMPTS = int(os.getenv("SHEETS_RETRY_ATTEMPTS", "3"))
+CB_FAILURES = int(os.getenv("SHEETS_CB_FAILURES", "5"))
+CB_RESET_SEC = float(os.getenv("SHEETS_CB_RESET_SEC", "30"))
+
+
+class SheetsError(Exception):
+    pass
+
+
+class TransientError(SheetsError):
+    """خطای موقت (شبکه، timeout، 5xx/429) که ارزش تلاش دوباره داره"""
+
+
+class CircuitOpenError(SheetsError):
+    """Apps Script فعلا ناسالمه؛ بدون درخواست فوری خطا می‌دیم"""
+
+
+class CircuitBreaker:
+    """
+    closed: عادی. بعد از CB_FAILURES خطای پشت سر هم -> open.
+    open: همه‌ی درخواست‌ها فوری رد میشن تا CB_RESET_SEC بگذره.
+    half_open: فقط یک درخواست آزمایشی؛ موفق -> closed، ناموفق -> دوباره open.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = ""
+        self.rejected = 0
+
+    def before_call(self):
+        if self.state == "closed":
+            return
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self.opened_at = now
+            return
+        self.rejected += 1
+        raise CircuitOpenError(f"circuit {self.state}: {self.last_error}")
+
+    def record_success(self):
+        self.failures = 0
+        self.state = "closed"
+
+    def record_failure(self, error: str):
+        self.failures += 1
+        self.last_error = error
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                log_error(f"Sheets circuit OPEN after {self.failures} failures: {error}")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+            "open_for_sec": round(time.monotonic() - self.opened_at, 1) if self.state != "closed" else 0,
+        }
+
+
+class AdaptiveTimeout:
+    """
+    timeout هر عملیات مثل RTO در TCP: srtt + 4 * rttvar،
+    محدود به [TIMEOUT_FLOOR_SEC, TIMEOUTS[op]]. تا نمونه نداریم همان سقف استفاده میشه.
+    """
+
+    def __init__(self, floor: float):
+        self.floor = floor
+        self._stats = {}  # op -> [srtt, rttvar]
+
+    def timeout(self, op: str) -> float:
+        ceiling = TIMEOUTS.get(op, 25)
+        st = self._stats.get(op)
+        if not st:
+            return ceiling
+        return min(ceiling, max(self.floor, st[0] + 4 * st[1]))
+
+    def observe(self, op: str, sample: float):
+        st = self._stats.get(op)
+        if not st:
+            self._stats[op] = [sample, sample / 2]
+            return
+        st[1] = 0.75 * st[1] + 0.25 * abs(st[0] - sample)
+        st[0] = 0.875 * st[0] + 0.125 * sample
+
+    def snapshot(self) -> dict:
+        return {
+            op: {"srtt": round(st[0], 3), "rttvar": round(st[1], 3), "timeout": round(self.timeout(op), 2)}
+            for op, st in self._stats.items()
+        }
+
+
+breaker = CircuitBreaker(CB_FAILURES, CB_RESET_SEC)
+timeouts = AdaptiveTimeout(TIMEOUT_FLOOR_SEC)
+
+_retry_transient = retry(
+    retry=retry_if_exception_type(TransientError),
+    stop=stop_after_attempt(RETRY_ATTEMPTS),
+    wait=wait_exponential(min=1, max=8),
+    reraise=True,
+)
+
+
+class SheetsClient:
+    """
+    کلاینت Apps Script با یک session و connection pool مشترک.
+    با start/close در lifespan برنامه باز و بسته می‌شود.
+    """
+
+    def __init__(self, api: str):
+        self.api = api
+        self._session: aiohttp.ClientSession | None = None
+
+    async def start(self):
+        if self._session is not None and not self._session.closed:
+            return self._session
+        connector = aiohttp.TCPConnector(
+            limit=POOL_LIMIT,
+            ttl_dns_cache=600,
+            keepalive_timeout=KEEPALIVE_SEC,
+        )
+        self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            return await self.start()
+        return self._session
+
+    async def _request(self, op: str, method: str, idempotent: bool = True, observe_as=None, **kwargs):
+        """
+        یک تلاش. شکست‌ها اینجا در breaker ثبت نمیشن (یک بار برای کل تلاش‌ها در _call).
+        observe_as(data): کلید آمار timeout بر اساس جواب (مثلا not_modified کوچک جدا از دانلود کامل)
+        """
+        breaker.before_call()
+        session = await self._get_session()
+        limit = timeouts.timeout(op)
+        started = time.monotonic()
+        try:
+            async with session.request(method, self.api, timeout=aiohttp.ClientTimeout(total=limit), **kwargs) as r:
+                # 429 یعنی درخواست اجرا نشده؛ 5xx ممکنه بعد از اجرا برگشته باشه (مثلا append_row نوشته شده)
+                if r.status == 429 or (r.status >= 500 and idempotent):
+                    raise TransientError(f"{op} HTTP {r.status}")
+                if r.status >= 500:
+                    raise SheetsError(f"{op} HTTP {r.status}")
+                data = await _safe_json(r)
+        except aiohttp.ClientConnectorError as e:
+            # درخواست اصلا ارسال نشده؛ حتی برای append_row هم تکرارش امنه
+            raise TransientError(f"{op} connect: {e}") from e
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            if isinstance(e, asyncio.TimeoutError):
+                timeouts.observe(op, limit)
+            error = f"{op} {type(e).__name__}: {e}"
+            if idempotent:
+                raise TransientError(error) from e
+            raise SheetsError(error) from e
+
+        timeouts.observe(observe_as(data) if observe_as else op, time.monotonic() - started)
+        if data.get("ok") is False and not _unknown_action(data):
+            # خطای Apps Script با HTTP 200 (quota، صفحه‌ی HTML و ...) هم شکست حساب میشه
+            breaker.record_failure(f"{op}: {str(data.get('error'))[:200]}")
+        else:
+            breaker.record_success()
+        return data
+
+    async def _call(self, op: str, method: str, **kwargs):
+        """یک فراخوانی منطقی: تلاش‌های دوباره روی TransientError، و فقط یک شکست در breaker"""
+        try:
+            return await _retry_transient(self._request)(op, method, **kwargs)
+        except CircuitOpenError:
+            raise
+        except SheetsError as e:
+            breaker.record_failure(str(e))
+            raise
+
+    async def get(self, op: str, params: dict, observe_as=None):
+        return await self._call(op, "GET", params=params, observe_as=observe_as)
+
+    async def post(self, op: str, payload: dict, idempotent: bool = True):
+        return await self._call(op, "POST", idempotent=idempotent, json=payload)
+
+
+client = SheetsClient(API)
+
+
+async def start_client():
+    await client.start()
+
+
+async def close_client():
+    await flush_snapshots()
+    await client.close()
+
+
+def health() -> dict:
+    """وضعیت کلاینت Apps Script برای مانیتورینگ"""
+    return {
+        "circuit": breaker.snapshot(),
+        "timeouts": timeouts.snapshot(),
+        "cache": {
+            k.split("::", 1)[1]: {"age_sec": round(e.age(), 1), "expired": e.expired, "rows": len(e.rows)}
+            for k, e in cache.items()
+        },
+    }
 
 
 def _key(sheet: str) -> str:
     return f"sheet::{sheet}"
 
 
+# نسخه‌ی هر شیت: فقط وقتی ردیف‌های کش واقعا عوض بشن یکی زیاد میشه
+# (داده‌ی تازه، delta با تغییر، write-through). کش‌های مشتق‌شده (تسک‌های parse شده و ...)
+# روی همین نسخه کلید می‌خورن، پس revalidate بدون تغییر (not_modified) چیزی رو دوباره parse نمی‌کنه.
+_versions: dict[str, int] = {}
+# شمارنده‌ی invalidate/تغییر محلی: fetchی که وسطش این عوض بشه نتیجه‌اش رو تازه حساب نمی‌کنیم
+_generations: dict[str, int] = {}
+
+
+def sheet_version(sheet: str) -> int:
+    return _versions.get(sheet, 0)
+
+
+def _generation(sheet: str) -> int:
+    return _generations.get(sheet, 0)
+
+
+def _bump(sheet: str):
+    _versions[sheet] = _versions.get(sheet, 0) + 1
+    _generations[sheet] = _generations.get(sheet, 0) + 1
+    _schedule_snapshot(sheet)
+
+
+# ---- snapshot روی دیسک برای cold start سریع (core/snapshots.py) ----
+SNAPSHOT_DELAY_SEC = float(os.getenv("SHEETS_SNAPSHOT_DELAY_SEC", "2"))
+_snapshot_pending: dict[str, asyncio.Task] = {}
+
+
+def _schedule_snapshot(sheet: str):
+    # چند تغییر پشت سر هم (مثلا write-throughهای یک job) فقط یک بار نوشته میشن
+    if sheet in _snapshot_pending:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _snapshot_pending[sheet] = loop.create_task(_save_snapshot_later(sheet))
+
+
+async def _save_snapshot_later(sheet: str):
+    try:
+        await asyncio.sleep(SNAPSHOT_DELAY_SEC)
+    finally:
+        if _snapshot_pending.get(sheet) is asyncio.current_task():
+            del _snapshot_pending[sheet]
+    await _save_snapshot(sheet)
+
+
+async def _save_snapshot(sheet: str):
+    entry = cache.get(_key(sheet))
+    if entry is None:
+        return
+    # کپی سطحی تا وسط نوشتن در thread، patchهای بعدی روی لیست اثر نذارن
+    rows = [list(r) if isinstance(r, list) else r for r in entry.rows]
+    await asyncio.to_thread(save_snapshot, sheet, rows, entry.etag, sheet_version(sheet))
+
+
+def _touch_snapshot(sheet: str, etag: str | None):
+    # اگر save در صفه، همان saved_at رو تازه می‌کنه
+    if sheet in _snapshot_pending:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(asyncio.to_thread(touch_snapshot, sheet, etag))
+    _snapshot_touches.add(task)
+    task.add_done_callback(_snapshot_touches.discard)
+
+
+_snapshot_touches: set = set()
+
+
+async def flush_snapshots():
+    pending = list(_snapshot_pending.items())
+    _snapshot_pending.clear()
+    for sheet, task in pending:
+        task.cancel()
+        await _save_snapshot(sheet)
+
+
+async def restore_snapshots():
+    """
+    موقع startup: آخرین نسخه‌ی ذخیره‌شده‌ی شیت‌ها با سن واقعی‌شون وارد کش میشه (restored)
+    تا اولین درخواست فوری جواب بگیره، و revalidate در پس‌زمینه شروع میشه.
+    """
+    snaps = await asyncio.to_thread(load_snapshots)
+    now = time.time()
+    restored = []
+    for sheet, snap in snaps.items():
+        if _key(sheet) in cache:
+            continue
+        if now - snap["saved_at"] > CACHE_TTL + CACHE_STALE_IF_ERROR:
+            continue
+        entry = _Entry(snap["rows"], snap["etag"])
+        # سن واقعی snapshot حفظ میشه تا سقف stale-if-error بعد از restart از نو شروع نشه
+        entry.fetched_at = time.monotonic() - max(0.0, now - snap["saved_at"])
+        entry.restored = True
+        cache[_key(sheet)] = entry
+        _versions[sheet] = _versions.get(sheet, 0) + 1
+        restored.append(sheet)
+
+    if restored:
+        log_info(f"Restored sheet snapshots: {restored}")
+    if API:
+        for sheet in restored:
+            _start_fetch(sheet)
+    return restored
+
+
 def invalidate(sheet: str):
-    k = _key(sheet)
-    if k in cache:
-        del cache[k]
+    entry = cache.get(_key(sheet))
+    if entry is not None:
+        entry.expired = True
+    # fetch در حال اجرا ممکنه داده‌ی قدیمی بیاره؛ callerهای بعدی fetch جدید می‌گیرن
+    _inflight.pop(sheet, None)
+    _generations[sheet] = _generations.get(sheet, 0) + 1
+
+
+def write_through(sheet: str, updates: list):
+    """
+    نوشتن موفق رو مستقیم روی ردیف‌های کش‌شده اعمال می‌کنه (به جای invalidate و دانلود دوباره‌ی کل شیت).
+    updates: [(row, col, value), ...] با اندیس ۱-مبنا مثل Apps Script
+    """
+    entry = cache.get(_key(sheet))
+    if entry is None:
+        return
+    rows = entry.rows
+    entry.etag = None  # ردیف‌ها دیگه دقیقا همان نسخه‌ی etag نیستن
+    for row, col, value in updates:
+        if row < 1 or col < 1:
+            continue
+        while len(rows) < row:
+            rows.append([])
+        r = rows[row - 1]
+        while len(r) < col:
+            r.append("")
+        r[col - 1] = value
+    _bump(sheet)
+
+
+def apply_row_patches(patches: list) -> dict:
+    """
+    تغییرات push شده از Google (/sync_tasks) رو مستقیم روی ردیف‌های کش اعمال می‌کنه.
+    patches: [{"sheet": "Tasks", "row": 12, "values": [...]}, ...] با row ۱-مبنا (ردیف len+1 یعنی append)
+    اگر حتی یک patch یک شیت قابل اعمال نبود (ردیف خارج از محدوده، payload خراب) هیچ‌کدوم اعمال نمیشن و اون شیت invalidate میشه.
+    ایندکس‌های مشتق‌شده با بالا رفتن نسخه از روی همین ردیف‌ها دوباره ساخته میشن (بدون fetch).
+    """
+    by_sheet = {}
+    for p in patches or []:
+        sheet = str((p or {}).get("sheet") or "").strip()
+        if sheet:
+            by_sheet.setdefault(sheet, []).append(p)
+
+    applied, invalidated = 0, []
+    for sheet, items in by_sheet.items():
+        entry = cache.get(_key(sheet))
+        if entry is None:
+            # کش نداریم؛ fetch بعدی خودش داده‌ی تازه رو میاره
+            continue
+
+        # اول همه‌ی patchهای این شیت بررسی میشن؛ یا همه اعمال میشن یا هیچ‌کدوم (تا ردیف‌ها و نسخه همخوان بمونن)
+        valid = []
+        length = len(entry.rows)
+        for p in items:
+            try:
+                row = int(p.get("row"))
+            except (TypeError, ValueError):
+                valid = None
+                break
+            values = p.get("values")
+            if not isinstance(values, list) or row < 1 or row > length + 1:
+                valid = None
+                break
+            if row == length + 1:
+                length += 1  # append؛ patch بعدی می‌تونه همین ردیف یا ردیف بعدی باشه
+            valid.append((row, values))
+
+        if valid is None:
+            invalidate(sheet)
+            invalidated.append(sheet)
+            continue
+
+        rows = entry.rows
+        for row, values in valid:
+            if row == len(rows) + 1:
+                rows.append(values)
+            else:
+                rows[row - 1] = values
+        applied += len(valid)
+        entry.etag = None
+        _bump(sheet)
+
+    return {"applied": applied, "invalidated": invalidated}
 
 
 async def _safe_json(resp: aiohttp.ClientResponse):
@@ -34,94 +477,317 @@ async def _safe_json(resp: aiohttp.ClientResponse):
             return {"ok": False, "error": "non-json response"}
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=8))
-async def get_sheet(sheet: str):
+_UNKNOWN_ACTION = ("unknown action", "invalid action", "unsupported action", "not supported")
+
+
+def _unknown_action(data: dict) -> bool:
+    """فقط وقتی Apps Script صراحتا action رو نمی‌شناسه (نه quota/lock/sheet not found و ...)"""
+    if data.get("ok"):
+        return False
+    error = str(data.get("error") or "").lower()
+    return any(p in error for p in _UNKNOWN_ACTION)
+
+
+# fetchهای در حال اجرا: برای هر شیت فقط یک درخواست همزمان (single-flight)
+_inflight: dict[str, asyncio.Task] = {}
+
+
+def block_hashes(rows: list, block_size: int) -> list:
+    """
+    fingerprint ردیف‌ها: md5 هر بلوک block_size ردیفی از JSON فشرده‌ی همان بلوک.
+    Apps Script هم باید دقیقا همین رو حساب کنه (JSON.stringify + MD5 روی UTF-8).
+    """
+    out = []
+    for i in range(0, len(rows), block_size):
+        raw = json.dumps(rows[i:i + block_size], ensure_ascii=False, separators=(",", ":"))
+        out.append(hashlib.md5(raw.encode("utf-8")).hexdigest())
+    return out
+
+
+# شیت‌هایی که Apps Script براشون delta پشتیبانی نمی‌کنه (بعد از اولین جواب منفی)
+_delta_unsupported: set = set()
+
+
+async def _fetch_full(sheet: str, entry: _Entry | None):
+    """
+    GET کامل شیت. اگر etag داریم درخواست شرطیه (if_none_match) و جواب
+    {"ok": true, "not_modified": true, "etag": ...} یعنی کش هنوز معتبره.
+    خروجی: (rows یا None برای not_modified, etag)
+    """
+    params = {"sheet": sheet}
+    if entry is not None and entry.etag:
+        params["if_none_match"] = entry.etag
+    # درخواست شرطی ممکنه کل شیت رو برگردونه، پس timeout همان دانلود کامل است؛
+    # ولی زمان جواب‌های not_modified جدا ثبت میشه
+    data = await client.get(
+        "get_sheet", params,
+        observe_as=lambda d: "get_sheet_not_modified" if d.get("not_modified") else "get_sheet",
+    )
+    if data.get("not_modified"):
+        return None, data.get("etag")
+    rows = data.get("rows")
+    if data.get("ok") is False or not isinstance(rows, list):
+        # خطای Apps Script با HTTP 200 (quota، صفحه‌ی HTML و ...) شیت خالی نیست؛
+        # با exception، get_sheet داده‌ی قبلی رو برمی‌گردونه (stale-if-error) و چیزی کش نمیشه
+        raise SheetsError(f"get_sheet {sheet} bad response: {str(data.get('error', data))[:200]}")
+    return rows, data.get("etag")
+
+
+async def _fetch_delta(sheet: str, entry: _Entry):
+    """
+    پروتکل delta: fingerprint بلوک‌های کش رو می‌فرستیم، Apps Script فقط بلوک‌های متفاوت
+    (و تعداد فعلی ردیف‌ها) رو برمی‌گردونه:
+        {"ok": true, "delta": true, "row_count": N, "blocks": {"<block index>": [[...], ...]}, "etag": ...}
+    اگر etag فرستاده شده هنوز معتبر باشه جواب فقط {"not_modified": true} است.
+    خروجی: (rows, changed) یا None اگر سرور delta بلد نبود
+    """
+    data = await client.post("delta", {
+        "action": "delta",
+        "sheet": sheet,
+        "if_none_match": entry.etag,
+        "block_size": DELTA_BLOCK,
+        "row_count": len(entry.rows),
+        "hashes": block_hashes(entry.rows, DELTA_BLOCK),
+    })
+    if cache.get(_key(sheet)) is not entry:
+        # وسط کار کش عوض شد؛ patch روی ردیف‌های قدیمی معنی نداره
+        return None
+
+    if data.get("not_modified"):
+        entry.etag = data.get("etag") or entry.etag
+        return entry.rows, False
+
+    if not data.get("delta"):
+        if isinstance(data.get("rows"), list):
+            # سرور تصمیم گرفت کل شیت رو بفرسته
+            entry.rows[:] = data["rows"]
+            entry.etag = data.get("etag")
+            return entry.rows, True
+        if _unknown_action(data):
+            log_error(f"delta not supported for {sheet}, using full fetch: {data.get('error')}")
+            _delta_unsupported.add(sheet)
+        else:
+            # خطای گذرا: فقط همین بار GET کامل (که خودش در صورت خطا به stale-if-error می‌رسه)
+            log_error(f"delta {sheet} failed, using full fetch: {data.get('error')}")
+        return None
+
+    row_count = int(data.get("row_count", 0))
+    blocks = data.get("blocks") or {}
+
+    rows = entry.rows
+    changed = row_count != len(rows) or bool(blocks)
+    del rows[row_count:]
+    while len(rows) < row_count:
+        rows.append([])
+    for idx, block in blocks.items():
+        start = int(idx) * DELTA_BLOCK
+        rows[start:start + len(block)] = block
+    entry.etag = data.get("etag")
+    return rows, changed
+
+
+async def _fetch_sheet(sheet: str):
+    generation = _generation(sheet)
     k = _key(sheet)
-    if k in cache:
-        return cache[k]
+    entry = cache.get(k)
+
+    result = None
+    if DELTA_SYNC and entry is not None and entry.rows and sheet not in _delta_unsupported:
+        result = await _fetch_delta(sheet, entry)
+
+    if result is None:
+        rows, etag = await _fetch_full(sheet, entry)
+        if rows is None:
+            # not_modified: ردیف‌های کش و همه‌ی ایندکس‌های مشتق‌شده دست‌نخورده می‌مونن
+            if entry is not None and cache.get(k) is entry:
+                result = (entry.rows, False)
+            else:
+                rows, etag = await _fetch_full(sheet, None)
+
+    if result is None:
+        # اگر وسط دانلود invalidate/patch شد، این نتیجه رو کش نمی‌کنیم
+        if _generation(sheet) == generation:
+            cache[k] = _Entry(rows, etag)
+            _bump(sheet)
+        return rows
+
+    # کش سر جاش به‌روز شد (delta یا not_modified)؛ فقط اگر چیزی عوض شد نسخه بالا میره
+    rows, changed = result
+    fresh = _generation(sheet) == generation
+    if changed:
+        _bump(sheet)
+    elif fresh:
+        # بدون تغییر: snapshot دیسک هم "تازه تایید شده" حساب میشه (وگرنه بعد از ۲۴ ساعت در startup رد میشد)
+        _touch_snapshot(sheet, entry.etag)
+    if fresh:
+        entry.fetched_at = time.monotonic()
+        entry.expired = False
+        entry.restored = False
+    return rows
+
+
+def _start_fetch(sheet: str) -> asyncio.Task:
+    task = _inflight.get(sheet)
+    if task is not None:
+        return task
+
+    task = asyncio.create_task(_fetch_sheet(sheet))
+    _inflight[sheet] = task
+
+    def _done(t: asyncio.Task):
+        if _inflight.get(sheet) is t:
+            del _inflight[sheet]
+        if not t.cancelled() and t.exception() is not None:
+            log_error(f"fetch {sheet} ERROR: {t.exception()}")
+
+    task.add_done_callback(_done)
+    return task
+
+
+def _stale_fallback(sheet: str, entry: _Entry | None):
+    if entry is not None and entry.age() < CACHE_TTL + CACHE_STALE_IF_ERROR:
+        log_error(f"get_sheet serving stale {sheet} (age={int(entry.age())}s)")
+        return entry.rows
+    return []
+
+
+async def get_sheet(sheet: str):
+    entry = cache.get(_key(sheet))
+    if entry is not None and not entry.expired:
+        age = entry.age()
+        if age < CACHE_TTL:
+            return entry.rows
+        # snapshot دیسک تا سقف stale-if-error فوری سرو میشه (cold start)، بقیه فقط در پنجره‌ی SWR
+        swr_limit = CACHE_STALE_IF_ERROR if entry.restored else CACHE_STALE_WHILE_REVALIDATE
+        if age < CACHE_TTL + swr_limit and API:
+            # stale-while-revalidate: همین الان داده‌ی قبلی، تازه‌سازی در پس‌زمینه
+            _start_fetch(sheet)
+            return entry.rows
 
     if not API:
         log_error("GOOGLE_API_URL not set")
-        return []
+        return entry.rows if entry is not None else []
 
-    url = f"{API}?sheet={sheet}"
+    task = _start_fetch(sheet)
     try:
-        timeout = aiohttp.ClientTimeout(total=25)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as r:
-                data = await _safe_json(r)
-                rows = data.get("rows", [])
-                if not isinstance(rows, list):
-                    log_error(f"Bad sheet response: {data}")
-                    return []
-                cache[k] = rows
-                return rows
+        # shield: کنسل شدن یک caller، fetch مشترک بقیه رو کنسل نمی‌کنه
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if task.cancelled() and not asyncio.current_task().cancelling():
+            return _stale_fallback(sheet, entry)
+        raise
     except Exception as e:
         log_error(f"get_sheet ERROR: {e}")
-        return []
+        return _stale_fallback(sheet, entry)
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=8))
 async def update_cell(sheet: str, row: int, col: int, value):
     if not API:
         log_error("GOOGLE_API_URL not set")
         return False
 
     try:
-        timeout = aiohttp.ClientTimeout(total=25)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(
-                API,
-                json={"action": "update_cell", "sheet": sheet, "row": row, "col": col, "value": value},
-            ) as r:
-                data = await _safe_json(r)
-                ok = bool(data.get("ok"))
-                if ok:
-                    invalidate(sheet)
-                return ok
+        data = await client.post(
+            "update_cell",
+            {"action": "update_cell", "sheet": sheet, "row": row, "col": col, "value": value},
+        )
+        ok = bool(data.get("ok"))
+        if ok:
+            invalidate(sheet)
+        return ok
     except Exception as e:
         log_error(f"update_cell ERROR: {e}")
         return False
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=8))
+# اگر Apps Script هنوز batch_update نداشت، به update_cell تکی برمی‌گردیم
+_batch_supported = True
+
+
+async def _batch_chunk(sheet: str, chunk: list):
+    global _batch_supported
+    if _batch_supported:
+        data = await client.post("batch_update", {
+            "action": "batch_update",
+            "sheet": sheet,
+            "updates": [{"row": r, "col": c, "value": v} for r, c, v in chunk],
+        })
+        results = data.get("results")
+        if isinstance(results, list) and len(results) == len(chunk):
+            return [bool(x.get("ok")) if isinstance(x, dict) else bool(x) for x in results]
+        if data.get("ok"):
+            return [True] * len(chunk)
+        if not _unknown_action(data):
+            # خطای گذرا (lock، quota، ...)؛ نوشتن‌ها ناموفق‌اند ولی batch_update کنار گذاشته نمیشه
+            log_error(f"batch_update {sheet} failed: {data.get('error')}")
+            return [False] * len(chunk)
+        log_error(f"batch_update not supported, falling back to update_cell: {data.get('error')}")
+        _batch_supported = False
+
+    return [await update_cell(sheet, r, c, v) for r, c, v in chunk]
+
+
+async def batch_update(sheet: str, updates: list, write_through_cache: bool = False):
+    """
+    چند سلول با یک درخواست. updates: [(row, col, value), ...]
+    خروجی: لیست ok به ازای هر سلول (به همان ترتیب)
+    write_through_cache: سلول‌های موفق روی کش نوشته میشن و کل شیت invalidate نمیشه
+    (فقط برای ستون‌هایی که فرمول وابسته ندارن، مثل reminders)
+    """
+    if not updates:
+        return []
+    if not API:
+        log_error("GOOGLE_API_URL not set")
+        return [False] * len(updates)
+
+    results = []
+    for i in range(0, len(updates), BATCH_MAX):
+        chunk = updates[i:i + BATCH_MAX]
+        try:
+            results.extend(await _batch_chunk(sheet, chunk))
+        except Exception as e:
+            log_error(f"batch_update ERROR: {e}")
+            results.extend([False] * len(chunk))
+
+    if write_through_cache:
+        write_through(sheet, [u for u, ok in zip(updates, results) if ok])
+    elif any(results):
+        invalidate(sheet)
+    return results
+
+
 async def append_row(sheet: str, row_data: list):
     if not API:
         log_error("GOOGLE_API_URL not set")
         return False
 
     try:
-        timeout = aiohttp.ClientTimeout(total=25)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(
-                API,
-                json={"action": "append_row", "sheet": sheet, "row": row_data},
-            ) as r:
-                data = await _safe_json(r)
-                ok = bool(data.get("ok"))
-                if ok:
-                    invalidate(sheet)
-                return ok
+        # append تکرارپذیر نیست: فقط وقتی دوباره تلاش می‌کنیم که درخواست اصلا ارسال نشده
+        data = await client.post(
+            "append_row",
+            {"action": "append_row", "sheet": sheet, "row": row_data},
+            idempotent=False,
+        )
+        ok = bool(data.get("ok"))
+        if ok:
+            invalidate(sheet)
+        return ok
     except Exception as e:
         log_error(f"append_row ERROR: {e}")
         return False
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=8))
 async def sync_tasks():
     if not API:
         log_error("GOOGLE_API_URL not set")
         return False
 
     try:
-        timeout = aiohttp.ClientTimeout(total=40)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(API, json={"action": "sync_tasks"}) as r:
-                data = await _safe_json(r)
-                ok = bool(data.get("ok"))
-                if ok:
-                    invalidate("Tasks")
-                return ok
+        data = await client.post("sync_tasks", {"action": "sync_tasks"})
+        ok = bool(data.get("ok"))
+        if ok:
+            invalidate("Tasks")
+        return ok
     except Exception as e:
         log_error(f"sync_tasks ERROR: {e}")
         return False
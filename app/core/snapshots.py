@@ -0,0 +1,76 @@
+# app/core/snapshots.py
+# -*- coding: utf-8 -*-
+
+import json
+import time
+
+from core.db import connect
+from core.logging import log_error
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheet_snapshots (
+    sheet    TEXT PRIMARY KEY,
+    rows     TEXT NOT NULL,
+    etag     TEXT,
+    version  INTEGER NOT NULL,
+    saved_at REAL NOT NULL
+)
+"""
+
+
+def save_snapshot(sheet: str, rows: list, etag: str | None, version: int):
+    """آخرین نسخه‌ی سالم یک شیت روی دیسک (sync؛ از event loop با to_thread صدا زده میشه)"""
+    try:
+        payload = json.dumps(rows, ensure_ascii=False, separators=(",", ":"))
+        conn = connect()
+        try:
+            with conn:
+                conn.execute(_SCHEMA)
+                conn.execute(
+                    "INSERT OR REPLACE INTO sheet_snapshots (sheet, rows, etag, version, saved_at) VALUES (?, ?, ?, ?, ?)",
+                    (sheet, payload, etag, version, time.time()),
+                )
+        finally:
+            conn.close()
+    except Exception as e:
+        log_error(f"save_snapshot {sheet} ERROR: {e}")
+
+
+def touch_snapshot(sheet: str, etag: str | None):
+    """revalidate بدون تغییر (not_modified): همان ردیف‌ها هنوز معتبرن، فقط saved_at (و etag) به‌روز میشه"""
+    try:
+        conn = connect()
+        try:
+            with conn:
+                conn.execute(_SCHEMA)
+                conn.execute(
+                    "UPDATE sheet_snapshots SET saved_at = ?, etag = COALESCE(?, etag) WHERE sheet = ?",
+                    (time.time(), etag, sheet),
+                )
+        finally:
+            conn.close()
+    except Exception as e:
+        log_error(f"touch_snapshot {sheet} ERROR: {e}")
+
+
+def load_snapshots() -> dict:
+    """خروجی: sheet -> {"rows", "etag", "version", "saved_at"}"""
+    out = {}
+    try:
+        conn = connect()
+        try:
+            conn.execute(_SCHEMA)
+            for sheet, payload, etag, version, saved_at in conn.execute(
+                "SELECT sheet, rows, etag, version, saved_at FROM sheet_snapshots"
+            ):
+                try:
+                    rows = json.loads(payload)
+                except Exception:
+                    continue
+                if isinstance(rows, list):
+                    out[sheet] = {"rows": rows, "etag": etag, "version": version, "saved_at": saved_at}
+        finally:
+            conn.close()
+    except Exception as e:
+        log_error(f"load_snapshots ERROR: {e}")
+    return out
@@ -1,60 +1,186 @@
 # app/core/state.py
 # -*- coding: utf-8 -*-
 
+import os
 import json
+import queue
+import itertools
+import threading
 from pathlib import Path
-from threading import Lock
+from cachetools import TTLCache
 
-STATE_FILE = Path("app/db/states.json")
-_LOCK = Lock()
-
-
-def _ensure_dir():
-    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+from core.db import connect
+from core.logging import log_error, log_info
 
+# فایل قدیمی؛ فقط یک بار به SQLite منتقل میشه (خود فایل دست‌نخورده می‌مونه)
+STATE_FILE = Path("app/db/states.json")
 
-def load_states():
-    _ensure_dir()
-    if STATE_FILE.exists():
+# فقط state کاربرهای اخیر در حافظه می‌مونه (LRU + TTL)، بقیه از دیسک lazy خونده میشن
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "2000"))
+STATE_CACHE_TTL = int(os.getenv("STATE_CACHE_TTL", "3600"))
+
+_MISSING = object()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_states (
+    chat_id TEXT PRIMARY KEY,
+    data    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state_meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class StateStore:
+    """
+    state کاربرها در SQLite (WAL): هر تغییر فقط همان یک کلید رو upsert می‌کنه.
+    نوشتن‌ها در یک thread جدا انجام میشن تا event loop بلاک نشه.
+    حافظه: یک کش LRU/TTL محدود؛ کاربری که در کش نیست با یک SELECT روی کلید اصلی خونده میشه.
+    """
+
+    def __init__(self):
+        self._conn = connect()  # فقط برای خواندن از event loop
+        self._conn.executescript(_SCHEMA)
+        self._migrate_json()
+
+        self._cache = TTLCache(maxsize=STATE_CACHE_SIZE, ttl=STATE_CACHE_TTL)
+        # نوشتن‌هایی که هنوز commit نشدن: chat_id -> (seq, json)؛ خواندن اول اینجا رو می‌بینه
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="state-writer", daemon=True)
+        self._writer.start()
+
+    def _migrate_json(self):
+        if not STATE_FILE.exists():
+            return
+        done = self._conn.execute("SELECT 1 FROM state_meta WHERE key = 'json_migrated'").fetchone()
+        if done:
+            return
         try:
-            return json.loads(STATE_FILE.read_text(encoding="utf-8"))
-        except Exception:
-            return {}
-    return {}
-
-
-def save_states(states):
-    _ensure_dir()
-    with _LOCK:
-        STATE_FILE.write_text(
-            json.dumps(states, ensure_ascii=False, indent=2),
-            encoding="utf-8"
-        )
-
-
-_states = load_states()
+            old = json.loads(STATE_FILE.read_text(encoding="utf-8") or "{}")
+        except Exception as e:
+            log_error(f"state migration: bad {STATE_FILE}: {e}")
+            return
+        if not isinstance(old, dict):
+            old = {}
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO user_states (chat_id, data) VALUES (?, ?)",
+                [(str(k), json.dumps(v, ensure_ascii=False)) for k, v in old.items()],
+            )
+            self._conn.execute("INSERT OR REPLACE INTO state_meta (key, value) VALUES ('json_migrated', '1')")
+        log_info(f"Migrated {len(old)} user states from {STATE_FILE}")
+
+    def _write_loop(self):
+        conn = connect()
+        while True:
+            chat_id = self._queue.get()
+            if chat_id is None:
+                self._queue.task_done()
+                conn.close()
+                return
+            # هر چی تا الان صف شده با یک commit
+            ids = {chat_id}
+            count = 1
+            stop = False
+            while True:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                count += 1
+                if nxt is None:
+                    stop = True
+                    break
+                ids.add(nxt)
+
+            with self._lock:
+                batch = [(cid, self._pending[cid]) for cid in ids if cid in self._pending]
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO user_states (chat_id, data) VALUES (?, ?)",
+                        [(cid, data) for cid, (_, data) in batch],
+                    )
+                with self._lock:
+                    for cid, (seq, _) in batch:
+                        if self._pending.get(cid, (None,))[0] == seq:
+                            del self._pending[cid]
+            except Exception as e:
+                log_error(f"state write ERROR: {e}")
+            for _ in range(count):
+                self._queue.task_done()
+            if stop:
+                conn.close()
+                return
+
+    def get(self, chat_id: str):
+        state = self._cache.get(chat_id, _MISSING)
+        if state is not _MISSING:
+            return state
+
+        with self._lock:
+            pending = self._pending.get(chat_id)
+        if pending is not None:
+            state = json.loads(pending[1])
+        else:
+            row = self._conn.execute("SELECT data FROM user_states WHERE chat_id = ?", (chat_id,)).fetchone()
+            try:
+                state = json.loads(row[0]) if row else None
+            except Exception:
+                state = None
+        # None هم کش میشه تا کاربر بدون state هر بار به دیسک نره
+        self._cache[chat_id] = state
+        return state
+
+    def put(self, chat_id: str, state: dict):
+        self._cache[chat_id] = state
+        with self._lock:
+            self._pending[chat_id] = (next(self._seq), json.dumps(state, ensure_ascii=False))
+        self._queue.put(chat_id)
+
+    def flush(self):
+        """منتظر می‌مونه تا همه‌ی نوشتن‌های صف‌شده روی دیسک برن (برای shutdown)"""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join(timeout=10)
+        self._conn.close()
+
+
+_store = StateStore()
 
 
 def get_user_state(chat_id):
-    chat_id = str(chat_id)
-    if chat_id not in _states:
-        _states[chat_id] = {"step": "start"}
-        save_states(_states)
-    return _states[chat_id]
+    """
+    state پیش‌فرض فقط برگردونده میشه و چیزی نوشته نمیشه؛
+    برای ذخیره‌ی تغییر باید set_user_state صدا زده بشه.
+    """
+    state = _store.get(str(chat_id))
+    if state is None:
+        return {"step": "start"}
+    return state
 
 
 def set_user_state(chat_id, step=None, **kwargs):
     chat_id = str(chat_id)
-    if chat_id not in _states:
-        _states[chat_id] = {"step": "start"}
+    state = dict(_store.get(chat_id) or {"step": "start"})
     if step:
-        _states[chat_id]["step"] = step
+        state["step"] = step
     for key, value in kwargs.items():
-        _states[chat_id][key] = value
-    save_states(_states)
+        state[key] = value
+    _store.put(chat_id, state)
 
 
 def clear_user_state(chat_id):
-    chat_id = str(chat_id)
-    _states[chat_id] = {"step": "start"}
-    save_states(_states)
+    _store.put(str(chat_id), {"step": "start"})
+
+
+def flush_states():
+    _store.flush()
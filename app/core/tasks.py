@@ -2,11 +2,13 @@
 # -*- coding: utf-8 -*-
 
 from datetime import datetime, timedelta, date
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
 import re
 import json
 import pytz
 
-from core.sheets import get_sheet, update_cell, invalidate
+from core.sheets import get_sheet, batch_update, sheet_version
 from core.logging import log_error
 
 TASKS_SHEET = "Tasks"
@@ -52,8 +54,8 @@ def parse_time_hhmm(s: str):
         return (h, mi)
     return None
 
-# Jalali -> Gregorian
-def jalali_to_gregorian(jy: int, jm: int, jd: int) -> date:
+# Jalali -> Gregorian (محاسبه‌ی کامل؛ فقط برای اول هر سال و به عنوان مرجع در devtools/bench_jalali.py)
+def _jalali_to_gregorian_arith(jy: int, jm: int, jd: int) -> date:
     jy += 1595
     days = -355668 + (365 * jy) + (jy // 33) * 8 + ((jy % 33) + 3) // 4 + jd
     if jm < 7:
@@ -86,7 +88,45 @@ def jalali_to_gregorian(jy: int, jm: int, jd: int) -> date:
         gm += 1
     return date(gy, gm, gd)
 
+# فاصله‌ی اول هر ماه از اول سال (۶ ماه ۳۱ روزه، بعد ۳۰ روزه)
+_JALALI_MONTH_OFFSET = [0] + [(m - 1) * 31 if m < 7 else (m - 7) * 30 + 186 for m in range(1, 13)]
+
+@lru_cache(maxsize=512)
+def _jalali_year_start(jy: int) -> int:
+    """ordinal میلادیِ ۱ فروردین سال jy"""
+    return _jalali_to_gregorian_arith(jy, 1, 1).toordinal()
+
+def jalali_to_gregorian(jy: int, jm: int, jd: int) -> date:
+    # محاسبه‌ی بالا نسبت به روز و ماه خطی است => اول سال + فاصله‌ی ماه + روز
+    if not 1 <= jm <= 12:
+        return _jalali_to_gregorian_arith(jy, jm, jd)
+    return date.fromordinal(_jalali_year_start(jy) + _JALALI_MONTH_OFFSET[jm] + jd - 1)
+
 def parse_jalali_date(date_fa: str):
+    # شیت فقط چند صد تاریخ متفاوت داره؛ رشته‌ها memo میشن (date immutable است)
+    if isinstance(date_fa, str):
+        return _parse_jalali_cached(date_fa)
+    return _parse_jalali(date_fa)
+
+def parse_jalali_dates(values) -> list:
+    """تبدیل یک ستون کامل؛ هر مقدار تکراری فقط یکبار parse میشه"""
+    memo = {}
+    out = []
+    for v in values:
+        try:
+            d = memo[v]
+        except KeyError:
+            d = memo[v] = parse_jalali_date(v)
+        except TypeError:
+            d = parse_jalali_date(v)
+        out.append(d)
+    return out
+
+@lru_cache(maxsize=4096)
+def _parse_jalali_cached(date_fa: str):
+    return _parse_jalali(date_fa)
+
+def _parse_jalali(date_fa):
     s = clean(date_fa).replace("-", "/")
     if not s:
         return None
@@ -177,13 +217,16 @@ def group_tasks_by_date(tasks: list):
         mp.setdefault(d, []).append(t)
     return sorted(mp.items(), key=lambda x: x[0])
 
-async def load_tasks():
-    rows = await get_sheet(TASKS_SHEET)
-    if not rows or len(rows) < 2:
-        return []
-
+async def _parse_tasks(rows):
+    """
+    parse کامل ردیف‌های شیت Tasks؛ delay_days اینجا حساب نمیشه چون به تاریخ امروز بستگی داره
+    """
     schema = await get_tasks_schema(rows)
-    today = datetime.now(IRAN_TZ).date()
+
+    col = schema["date_fa"]
+    dates = parse_jalali_dates(
+        row[col] if isinstance(row, list) and len(row) > col else "" for row in rows[1:]
+    )
 
     out = []
     for i, row in enumerate(rows[1:], start=2):
@@ -195,7 +238,7 @@ async def load_tasks():
             continue
 
         date_fa = clean(row[schema["date_fa"]]) if len(row) > schema["date_fa"] else ""
-        date_en = parse_jalali_date(date_fa)
+        date_en = dates[i - 2]
         if not date_en:
             continue
 
@@ -204,8 +247,6 @@ async def load_tasks():
             log_error(f"Task title empty for task_id={task_id} row={i}")
             continue
 
-        delay_days = (today - date_en).days
-
         reminders_str = clean(row[schema["reminders"]]) if len(row) > schema["reminders"] else "{}"
         try:
             reminders = json.loads(reminders_str) if reminders_str else {}
@@ -231,69 +272,166 @@ async def load_tasks():
             "status": clean(row[schema["status"]]) if len(row) > schema["status"] else "In Progress",
             "done": done,
             "reminders": reminders,
-            "delay_days": delay_days,
             "_schema": schema,
         })
 
     return out
 
+class TaskIndex:
+    """
+    ایندکس تسک‌ها که یک بار برای هر نسخه‌ی شیت ساخته میشه:
+    - by_id: task_id -> رکورد (اولین ردیف با این id، مثل جستجوی خطی قبلی)
+    - by_team: تیم -> (لیست تاریخ‌ها، لیست تسک‌ها) مرتب بر اساس تاریخ برای جستجوی bisect
+    """
+
+    def __init__(self, tasks: list):
+        self.tasks = tasks
+        self.by_id = {}
+        grouped = {}
+        for t in tasks:
+            self.by_id.setdefault(t["task_id"], t)
+            grouped.setdefault(t["team"], []).append(t)
+
+        self.by_team = {}
+        for team, items in grouped.items():
+            items.sort(key=lambda t: t["date_en"])  # stable: ترتیب شیت در هر روز حفظ میشه
+            self.by_team[team] = ([t["date_en"] for t in items], items)
+
+    def get(self, task_id: str):
+        return self.by_id.get(task_id)
+
+    def range(self, team: str, start: date | None = None, end: date | None = None):
+        """تسک‌های یک تیم با start <= date_en <= end (هر دو سر اختیاری)"""
+        entry = self.by_team.get(team)
+        if not entry:
+            return []
+        dates, items = entry
+        lo = bisect_left(dates, start) if start else 0
+        hi = bisect_right(dates, end) if end else len(items)
+        return items[lo:hi]
+
+_EMPTY_INDEX = TaskIndex([])
+
+# کش ایندکس تسک‌ها، کلید: نسخه‌ی شیت Tasks (بعد از invalidate("Tasks") فقط اگر ردیف‌ها واقعا عوض شده باشن دوباره ساخته میشه)
+_parsed = {"version": None, "index": _EMPTY_INDEX}
+
+async def load_task_index() -> TaskIndex:
+    rows = await get_sheet(TASKS_SHEET)
+    if not rows or len(rows) < 2:
+        return _EMPTY_INDEX
+
+    version = sheet_version(TASKS_SHEET)
+    if _parsed["version"] != version:
+        _parsed["index"] = TaskIndex(await _parse_tasks(rows))
+        _parsed["version"] = version
+    return _parsed["index"]
+
+def _with_delay(t: dict, today: date) -> dict:
+    return {**t, "delay_days": (today - t["date_en"]).days}
+
+async def load_tasks():
+    index = await load_task_index()
+    today = datetime.now(IRAN_TZ).date()
+    return [_with_delay(t, today) for t in index.tasks]
+
+async def _team_tasks(team: str, start: date | None, end: date | None):
+    index = await load_task_index()
+    today = datetime.now(IRAN_TZ).date()
+    return [_with_delay(t, today) for t in index.range(normalize_team(team), start, end) if not t["done"]]
+
 async def get_tasks_today(team: str):
-    tasks = await load_tasks()
     today = datetime.now(IRAN_TZ).date()
-    tn = normalize_team(team)
-    return [t for t in tasks if t["date_en"] == today and t["team"] == tn and not t["done"]]
+    return await _team_tasks(team, today, today)
 
 async def get_tasks_next_7_days(team: str, start_date: date | None = None):
-    tasks = await load_tasks()
     start = start_date or datetime.now(IRAN_TZ).date()
     end = start + timedelta(days=6)  # 7 روز شامل امروز
-    tn = normalize_team(team)
-    return [t for t in tasks if start <= t["date_en"] <= end and t["team"] == tn and not t["done"]]
+    return await _team_tasks(team, start, end)
 
 async def get_tasks_not_done(team: str, ref_date: date | None = None):
-    tasks = await load_tasks()
     today = ref_date or datetime.now(IRAN_TZ).date()
-    tn = normalize_team(team)
-    return [t for t in tasks if t["date_en"] < today and t["team"] == tn and not t["done"]]
+    return await _team_tasks(team, None, today - timedelta(days=1))
 
 async def update_task_status(task_id: str, new_status: str):
-    tasks = await load_tasks()
-    for t in tasks:
-        if t["task_id"] == task_id:
-            schema = t.get("_schema") or {}
-            col_status = int(schema.get("status", 9)) + 1
-            col_done = int(schema.get("done", 17)) + 1
+    t = (await load_task_index()).get(task_id)
+    if not t:
+        return False
 
-            ok1 = await update_cell(TASKS_SHEET, t["row_index"], col_status, new_status)
+    schema = t.get("_schema") or {}
+    col_status = int(schema.get("status", 9)) + 1
+    col_done = int(schema.get("done", 17)) + 1
 
-            ok2 = True
-            if new_status.strip().lower() in ["done", "completed", "finish", "finished", "تمام", "دان", "انجام شد"]:
-                ok2 = await update_cell(TASKS_SHEET, t["row_index"], col_done, "YES")
+    updates = [(t["row_index"], col_status, new_status)]
+    if new_status.strip().lower() in ["done", "completed", "finish", "finished", "تمام", "دان", "انجام شد"]:
+        updates.append((t["row_index"], col_done, "YES"))
 
-            if ok1 and ok2:
-                invalidate(TASKS_SHEET)
-                return True
-            return False
-    return False
+    # status و done با یک درخواست
+    results = await batch_update(TASKS_SHEET, updates)
+    return all(results)
+
+def _reminders_cell(t: dict, reminders_dict: dict):
+    schema = t.get("_schema") or {}
+    col_rem = int(schema.get("reminders", 18)) + 1
+    return (t["row_index"], col_rem, json.dumps(reminders_dict or {}, ensure_ascii=False))
 
 async def set_task_reminders_json(task_id: str, reminders_dict: dict):
-    tasks = await load_tasks()
-    for t in tasks:
-        if t["task_id"] == task_id:
-            schema = t.get("_schema") or {}
-            col_rem = int(schema.get("reminders", 18)) + 1
-            payload = json.dumps(reminders_dict or {}, ensure_ascii=False)
-            ok = await update_cell(TASKS_SHEET, t["row_index"], col_rem, payload)
-            if ok:
-                invalidate(TASKS_SHEET)
-            return ok
-    return False
+    """
+    ستون reminders مستقیم روی کش نوشته میشه (write-through) و شیت دوباره دانلود نمیشه.
+    برای چند تسک در یک اجرا از ReminderLedger استفاده کن.
+    """
+    t = (await load_task_index()).get(task_id)
+    if not t:
+        return False
+
+    row, col, payload = _reminders_cell(t, reminders_dict)
+    results = await batch_update(TASKS_SHEET, [(row, col, payload)], write_through_cache=True)
+    return bool(results and results[0])
 
 async def update_task_reminder(task_id: str, key: str, value):
-    tasks = await load_tasks()
-    for t in tasks:
-        if t["task_id"] == task_id:
-            reminders = t["reminders"] or {}
-            reminders[key] = value
-            return await set_task_reminders_json(task_id, reminders)
-    return False
+    t = (await load_task_index()).get(task_id)
+    if not t:
+        return False
+
+    reminders = dict(t["reminders"] or {})
+    reminders[key] = value
+    return await set_task_reminders_json(task_id, reminders)
+
+
+class ReminderLedger:
+    """
+    دفتر ریمایندرها برای یک اجرای کامل check_reminders:
+    خواندن و تغییر در حافظه، و در پایان یک batch_update با write-through روی کش
+    (بدون دانلود دوباره‌ی شیت Tasks بعد از هر تسک).
+    """
+
+    def __init__(self, index: TaskIndex):
+        self._index = index
+        self._state = {}
+        self._dirty = []
+
+    def get(self, task_id: str) -> dict:
+        if task_id not in self._state:
+            t = self._index.get(task_id)
+            self._state[task_id] = dict(t["reminders"] or {}) if t else {}
+        return self._state[task_id]
+
+    def mark(self, task_id: str, key: str, value):
+        self.get(task_id)[key] = value
+        if task_id not in self._dirty:
+            self._dirty.append(task_id)
+
+    async def persist(self) -> dict:
+        """خروجی: task_id -> ok"""
+        dirty, self._dirty = self._dirty, []
+        ids, updates = [], []
+        for task_id in dirty:
+            t = self._index.get(task_id)
+            if not t:
+                continue
+            ids.append(task_id)
+            updates.append(_reminders_cell(t, self._state[task_id]))
+
+        results = await batch_update(TASKS_SHEET, updates, write_through_cache=True)
+        out = {task_id: False for task_id in dirty}
+        out.update(zip(ids, results))
+        return out
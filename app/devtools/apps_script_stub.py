@@ -0,0 +1,114 @@
+# app/devtools/apps_script_stub.py
+# -*- coding: utf-8 -*-
+
+"""
+جایگزین محلی Apps Script برای تست آفلاین.
+شیت‌ها در حافظه نگه داشته می‌شن (اختیاری: از یک فایل JSON به شکل {"Tasks": [[...], ...], ...} لود میشن).
+actionها: update_cell, append_row, batch_update, sync_tasks و delta (همگام‌سازی بلوکی، core.sheets._fetch_delta).
+GET و delta با if_none_match شرطی هستن: اگر etag (hash کل شیت) عوض نشده باشه فقط not_modified برمی‌گرده.
+
+اجرا:
+    STUB_SHEETS_FILE=sheets.json uvicorn devtools.apps_script_stub:app --app-dir app --port 8081
+    GOOGLE_API_URL=http://127.0.0.1:8081/exec
+"""
+
+import os
+import json
+import hashlib
+from fastapi import FastAPI, Request
+
+SHEETS_FILE = os.getenv("STUB_SHEETS_FILE", "")
+
+app = FastAPI()
+app.state.sheets = {}
+app.state.calls = []  # (method, action/sheet) برای بررسی تعداد درخواست‌ها در تست
+
+if SHEETS_FILE and os.path.exists(SHEETS_FILE):
+    with open(SHEETS_FILE, encoding="utf-8") as f:
+        app.state.sheets = json.load(f)
+
+
+def _set_cell(rows: list, row: int, col: int, value):
+    if row < 1 or col < 1:
+        return False
+    while len(rows) < row:
+        rows.append([])
+    r = rows[row - 1]
+    while len(r) < col:
+        r.append("")
+    r[col - 1] = value
+    return True
+
+
+def _block_hashes(rows: list, block_size: int) -> list:
+    # معادل Apps Script: MD5(JSON.stringify(block)) روی UTF-8
+    out = []
+    for i in range(0, len(rows), block_size):
+        raw = json.dumps(rows[i:i + block_size], ensure_ascii=False, separators=(",", ":"))
+        out.append(hashlib.md5(raw.encode("utf-8")).hexdigest())
+    return out
+
+
+def _etag(rows: list) -> str:
+    raw = json.dumps(rows, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+@app.get("/exec")
+@app.get("/")
+async def do_get(sheet: str = "", if_none_match: str = ""):
+    app.state.calls.append(("GET", sheet))
+    if sheet not in app.state.sheets:
+        return {"ok": False, "error": f"sheet not found: {sheet}"}
+    rows = app.state.sheets[sheet]
+    etag = _etag(rows)
+    if if_none_match and if_none_match == etag:
+        return {"ok": True, "not_modified": True, "etag": etag}
+    return {"ok": True, "rows": rows, "etag": etag}
+
+
+@app.post("/exec")
+@app.post("/")
+async def do_post(request: Request):
+    body = await request.json()
+    action = body.get("action")
+    app.state.calls.append(("POST", action))
+    sheets = app.state.sheets
+
+    if action == "sync_tasks":
+        return {"ok": True}
+
+    sheet = body.get("sheet")
+    if sheet not in sheets:
+        return {"ok": False, "error": f"sheet not found: {sheet}"}
+    rows = sheets[sheet]
+
+    if action == "update_cell":
+        return {"ok": _set_cell(rows, int(body["row"]), int(body["col"]), body.get("value"))}
+
+    if action == "append_row":
+        rows.append(list(body.get("row") or []))
+        return {"ok": True}
+
+    if action == "batch_update":
+        results = []
+        for u in body.get("updates") or []:
+            try:
+                results.append({"ok": _set_cell(rows, int(u["row"]), int(u["col"]), u.get("value"))})
+            except Exception as e:
+                results.append({"ok": False, "error": str(e)})
+        return {"ok": all(r["ok"] for r in results), "results": results}
+
+    if action == "delta":
+        etag = _etag(rows)
+        if body.get("if_none_match") and body["if_none_match"] == etag:
+            return {"ok": True, "not_modified": True, "etag": etag}
+        block_size = max(1, int(body.get("block_size") or 64))
+        client_hashes = body.get("hashes") or []
+        blocks = {}
+        for i, h in enumerate(_block_hashes(rows, block_size)):
+            if i >= len(client_hashes) or client_hashes[i] != h:
+                blocks[str(i)] = rows[i * block_size:(i + 1) * block_size]
+        return {"ok": True, "delta": True, "row_count": len(rows), "blocks": blocks, "etag": etag}
+
+    return {"ok": False, "error": f"unknown action: {action}"}
@@ -0,0 +1,93 @@
+# app/devtools/bench_jalali.py
+# -*- coding: utf-8 -*-
+
+"""
+مقایسه‌ی تبدیل تاریخ جلالی: محاسبه‌ی کامل قبلی (هر ردیف) در برابر جدول اول سال + memo + تبدیل ستونی.
+اول برابری نتیجه روی کل بازه‌ی معتبر (سال ۱۲۰۰ تا ۱۶۰۰) چک میشه.
+
+اجرا:
+    PYTHONPATH=app python -m devtools.bench_jalali [rows] [distinct] [repeat]
+"""
+
+import sys
+import random
+import timeit
+
+from core.tasks import (
+    clean,
+    parse_jalali_date,
+    parse_jalali_dates,
+    _jalali_to_gregorian_arith,
+    _parse_jalali_cached,
+    jalali_to_gregorian,
+)
+
+
+def reference_parse(date_fa):
+    """parse_jalali_date قبلی، بدون هیچ کشی"""
+    s = clean(date_fa).replace("-", "/")
+    if not s:
+        return None
+    parts = [p for p in s.split("/") if p.strip()]
+    if len(parts) != 3:
+        return None
+    try:
+        y = int(parts[0]); m = int(parts[1]); d = int(parts[2])
+    except ValueError:
+        return None
+    if y < 1200 or y > 1600 or m < 1 or m > 12 or d < 1 or d > 31:
+        return None
+    return _jalali_to_gregorian_arith(y, m, d)
+
+
+def check_equivalence():
+    n = 0
+    for y in range(1200, 1601):
+        for m in range(1, 13):
+            for d in range(1, 32):
+                a = _jalali_to_gregorian_arith(y, m, d)
+                b = jalali_to_gregorian(y, m, d)
+                if a != b:
+                    raise AssertionError(f"{y}/{m}/{d}: {a} != {b}")
+                n += 1
+    for v in ["1403/1/1", "۱۴۰۳/۰۲/۱۵", "1403-12-30", "", None, "bad", "1403/13/1", 14030101]:
+        if reference_parse(v) != parse_jalali_date(v):
+            raise AssertionError(f"parse mismatch for {v!r}")
+    return n
+
+
+def make_column(rows: int, distinct: int):
+    rnd = random.Random(1)
+    pool = [f"{rnd.randint(1402, 1405)}/{rnd.randint(1, 12):02d}/{rnd.randint(1, 29):02d}" for _ in range(distinct)]
+    # بعضی‌ها با ارقام فارسی، مثل شیت واقعی
+    pool = [p.translate(str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹")) if i % 3 == 0 else p for i, p in enumerate(pool)]
+    return [rnd.choice(pool) for _ in range(rows)]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    print(f"equivalence: {check_equivalence()} dates OK")
+
+    column = make_column(rows, distinct)
+    assert [reference_parse(v) for v in column] == parse_jalali_dates(column)
+
+    def cold():
+        _parse_jalali_cached.cache_clear()
+        parse_jalali_dates(column)
+
+    results = {
+        "reference (per row)": timeit.timeit(lambda: [reference_parse(v) for v in column], number=repeat),
+        "parse_jalali_dates (cold memo)": timeit.timeit(cold, number=repeat),
+        "parse_jalali_dates (warm memo)": timeit.timeit(lambda: parse_jalali_dates(column), number=repeat),
+    }
+    base = results["reference (per row)"]
+    print(f"{rows} rows, {distinct} distinct dates, {repeat} runs")
+    for name, t in results.items():
+        print(f"  {name:32s} {t / repeat * 1000:8.3f} ms/column  x{base / t:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
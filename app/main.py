@@ -3,26 +3,66 @@
 
 import os
 import sys
+import hmac
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Header, HTTPException
+from fastapi.responses import JSONResponse
 
 APP_DIR = os.path.dirname(__file__)
 if APP_DIR not in sys.path:
     sys.path.insert(0, APP_DIR)
 
-from bot.handler import process_update
+from bot.handler import process_update, claim_update, release_update
+from bot.dispatcher import UpdateDispatcher
 from scheduler.job import run_weekly_jobs, run_daily_jobs, check_reminders
+from scheduler.runner import start_scheduler, stop_scheduler
+from scheduler.deadlines import start_deadline_timer, stop_deadline_timer, deadline_timer
 from core.logging import log_error
-from core.sheets import sync_tasks, invalidate
+from core.sheets import (
+    sync_tasks, invalidate, apply_row_patches, start_client, close_client, restore_snapshots,
+    health as sheets_health,
+)
+from bot.helpers import start_http, close_http
+from core.state import flush_states
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_http()
+    await start_client()
+    # داده‌ی ذخیره‌شده روی دیسک فوری در دسترسه؛ تازه‌سازی در پس‌زمینه
+    await restore_snapshots()
+    dispatcher.start()
+    start_scheduler()
+    start_deadline_timer()
+    try:
+        yield
+    finally:
+        stop_scheduler()
+        await stop_deadline_timer()
+        # اول آپدیت‌های در صف تموم میشن، بعد sessionها بسته میشن
+        await dispatcher.drain()
+        await close_client()
+        await close_http()
+        await asyncio.to_thread(flush_states)
+
+dispatcher = UpdateDispatcher(process_update)
+
+app = FastAPI(lifespan=lifespan)
 
 TRIGGER_TOKEN = os.getenv("TRIGGER_TOKEN", "").strip()
+# راز مشترک با Apps Script برای اعمال مستقیم patchها روی کش (پیش‌فرض: همان TRIGGER_TOKEN)
+SYNC_TOKEN = os.getenv("SYNC_TOKEN", "").strip() or TRIGGER_TOKEN
 
 def verify_trigger_token(x_trigger_token: str | None):
     # اگر TRIGGER_TOKEN ست نشده بود، چک رو رد می‌کنیم (برای توسعه)
     if TRIGGER_TOKEN and (x_trigger_token or "").strip() != TRIGGER_TOKEN:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
+def sync_token_ok(token: str | None) -> bool:
+    # برخلاف verify_trigger_token، بدون توکن ست‌شده هیچ patchی قبول نمیشه
+    return bool(SYNC_TOKEN) and hmac.compare_digest((token or "").strip(), SYNC_TOKEN)
+
 @app.get("/ping")
 async def ping():
     return "OK"
@@ -31,30 +71,58 @@ async def ping():
 async def root():
     return {"ok": True, "service": "clever-roadmap-bot"}
 
+@app.get("/health/sheets")
+async def health_sheets(x_trigger_token: str | None = Header(None)):
+    # last_error شامل آدرس backend و متن خطاست
+    verify_trigger_token(x_trigger_token)
+    return sheets_health()
+
 @app.post("/webhook")
 async def webhook(request: Request):
+    # فقط اعتبارسنجی، حذف تکراری و صف؛ پردازش در workerها تا تلگرام فوری جواب بگیره
     try:
         update = await request.json()
-        await process_update(update)
-        return {"ok": True}
     except Exception as e:
         log_error(f"Webhook ERROR: {e}")
-        return {"ok": False, "error": str(e)}
+        return {"ok": False, "error": "invalid json"}
+    if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+        return {"ok": False, "error": "invalid update"}
+
+    upd_id = update["update_id"]
+    if not dispatcher.has_capacity():
+        # تلگرام روی خطای 5xx دوباره می‌فرسته
+        return JSONResponse({"ok": False, "error": "busy"}, status_code=503)
+    if not await claim_update(upd_id):
+        return {"ok": True, "duplicate": True}
+    if not dispatcher.submit(update):
+        await release_update(upd_id)
+        return JSONResponse({"ok": False, "error": "busy"}, status_code=503)
+    return {"ok": True}
 
 @app.post("/sync_tasks")
-async def sync_tasks_endpoint(request: Request):
+async def sync_tasks_endpoint(request: Request, x_sync_token: str | None = Header(None)):
     body = await request.json() if request else {}
     body = body or {}
     from_google = bool(body.get("from_google", False))
+    trusted = sync_token_ok(x_sync_token or body.get("sync_token"))
 
     try:
         if not from_google:
             await sync_tasks()
+        elif isinstance(body.get("patches"), list) and trusted:
+            # Google خود ردیف‌های تغییرکرده رو فرستاده: مستقیم روی کش اعمال میشن
+            result = apply_row_patches(body["patches"])
+            if result["invalidated"]:
+                log_error(f"SYNC patches fell back to invalidate: {result['invalidated']}")
         else:
-            # وقتی خود Google خبر میده که sync شده
+            # وقتی خود Google خبر میده که sync شده (یا patch بدون توکن معتبر): فقط دوباره خوندن از منبع
+            if body.get("patches") is not None:
+                log_error("SYNC patches ignored: missing or invalid sync token")
             invalidate("Tasks")
             invalidate("members")
 
+        # زمان‌های ددلاین با نسخه‌ی جدید شیت دوباره حساب میشن
+        deadline_timer.wake()
         # بعد از هر sync یکبار reminders چک می‌کنیم
         await check_reminders()
         return {"ok": True}
@@ -64,21 +132,23 @@ async def sync_tasks_endpoint(request: Request):
 
 # ---- کرون‌ها: GET/POST هر دو، چون بعضی سرویس‌ها test run رو GET میزنن ----
 @app.api_route("/run/daily", methods=["GET", "POST"])
-async def run_daily(x_trigger_token: str | None = Header(None)):
+async def run_daily(force: bool = False, x_trigger_token: str | None = Header(None)):
     verify_trigger_token(x_trigger_token)
     try:
-        await run_daily_jobs()
-        return {"ok": True, "job": "daily"}
+        # فقط یکبار در روز بین همه‌ی workerها؛ ?force=1 برای اجرای دستی دوباره
+        ran = await run_daily_jobs(force=force)
+        return {"ok": True, "job": "daily", "ran": ran}
     except Exception as e:
         log_error(f"DAILY JOB ERROR: {e}")
         return {"ok": False, "error": str(e)}
 
 @app.api_route("/run/weekly", methods=["GET", "POST"])
-async def run_weekly(x_trigger_token: str | None = Header(None)):
+async def run_weekly(force: bool = False, x_trigger_token: str | None = Header(None)):
     verify_trigger_token(x_trigger_token)
     try:
-        await run_weekly_jobs()
-        return {"ok": True, "job": "weekly"}
+        # فقط یکبار در روز بین همه‌ی workerها؛ ?force=1 برای اجرای دستی دوباره
+        ran = await run_weekly_jobs(force=force)
+        return {"ok": True, "job": "weekly", "ran": ran}
     except Exception as e:
         log_error(f"WEEKLY JOB ERROR: {e}")
         return {"ok": False, "error": str(e)}
@@ -87,8 +157,8 @@ async def run_weekly(x_trigger_token: str | None = Header(None)):
 async def run_reminders(x_trigger_token: str | None = Header(None)):
     verify_trigger_token(x_trigger_token)
     try:
-        await check_reminders()
-        return {"ok": True, "job": "reminders"}
+        ran = await check_reminders()
+        return {"ok": True, "job": "reminders", "ran": ran}
     except Exception as e:
         log_error(f"REMINDERS JOB ERROR: {e}")
         return {"ok": False, "error": str(e)}
@@ -0,0 +1,168 @@
+# app/scheduler/deadlines.py
+# -*- coding: utf-8 -*-
+
+import os
+import heapq
+import asyncio
+from datetime import datetime, timedelta, time as dtime
+
+from core.sheets import sheet_version
+from core.tasks import TASKS_SHEET, load_task_index, parse_time_hhmm
+from scheduler.job import IRAN_TZ, fire_deadline_reminders
+from core.logging import log_error, log_info
+
+# ---- تایمر ددلاین‌های ساعت‌دار: دقیقا سر ساعت بیدار میشه به جای اسکن دوره‌ای همه‌ی تسک‌ها ----
+DEADLINE_TIMER_ENABLED = os.getenv("DEADLINE_TIMER_ENABLED", os.getenv("SCHEDULER_ENABLED", "1")).strip() not in ("0", "false", "no", "")
+# حداکثر خواب؛ تغییرات شیت (TTL کش) حداکثر با این تاخیر دیده میشن، مگر wake() صدا زده بشه
+DEADLINE_RESCAN_SEC = float(os.getenv("DEADLINE_RESCAN_SEC", "300"))
+# اگر worker دیگری lease داشت، بعد از این مدت دوباره امتحان میشه
+DEADLINE_RETRY_SEC = float(os.getenv("DEADLINE_RETRY_SEC", "30"))
+# ارسال/ثبت ناموفق با backoff نمایی دوباره امتحان میشه، حداکثر این تعداد بار در روز
+DEADLINE_MAX_RETRIES = int(os.getenv("DEADLINE_MAX_RETRIES", "6"))
+
+
+def deadline_fire_times(tasks: list, now: datetime) -> list:
+    """
+    heap از (زمان اجرا، task_id) برای ددلاین‌های ساعت‌دار امروز که هنوز ارسال نشدن
+    (زمان‌های گذشته هم می‌مونن تا فوری اجرا بشن)
+    """
+    today = now.date()
+    today_str = today.strftime("%Y-%m-%d")
+    heap = []
+    for t in tasks:
+        if t.get("done") or t["date_en"] != today:
+            continue
+        parsed = parse_time_hhmm(t.get("time") or "")
+        if not parsed:
+            continue
+        if str((t.get("reminders") or {}).get("deadline_time", "")).startswith(today_str):
+            continue
+        fire_at = IRAN_TZ.localize(datetime.combine(today, dtime(parsed[0], parsed[1])))
+        heap.append((fire_at, t["task_id"]))
+    heapq.heapify(heap)
+    return heap
+
+
+class DeadlineTimer:
+    """
+    برای هر نسخه‌ی شیت Tasks (و هر روز) heap زمان‌های ددلاین دوباره ساخته میشه؛
+    حلقه تا اولین زمان (یا حداکثر DEADLINE_RESCAN_SEC) می‌خوابه و فقط تسک‌های سررسیده رو اجرا می‌کنه.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._built_for = None  # (نسخه‌ی شیت، تاریخ)
+        # برای همان روز: task_id -> تعداد تلاش ناموفق، و ارسال‌شده‌هایی که ثبتشون مونده
+        self._day = None
+        self._attempts = {}
+        self._mark_only = set()
+        # task_id -> زودترین زمان تلاش بعدی؛ با rebuild heap (sync شیت) backoff از دست نمیره
+        self._next_retry = {}
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self):
+        """بعد از sync شیت: heap فوری دوباره ساخته میشه"""
+        self._wake.set()
+
+    async def _refresh(self, now: datetime):
+        index = await load_task_index()
+        if self._day != now.date():
+            self._day = now.date()
+            self._attempts.clear()
+            self._mark_only.clear()
+            self._next_retry.clear()
+        key = (sheet_version(TASKS_SHEET), now.date())
+        if key != self._built_for:
+            self._heap = [
+                (max(fire_at, self._next_retry.get(task_id, fire_at)), task_id)
+                for fire_at, task_id in deadline_fire_times(index.tasks, now)
+                if self._attempts.get(task_id, 0) <= DEADLINE_MAX_RETRIES
+            ]
+            heapq.heapify(self._heap)
+            self._built_for = key
+            log_info(f"Deadline timer: {len(self._heap)} pending for {now.date()}")
+
+    def _sleep_for(self, now: datetime) -> float:
+        delay = DEADLINE_RESCAN_SEC
+        if self._heap:
+            delay = min(delay, (self._heap[0][0] - now).total_seconds())
+        # نیمه‌شب heap روز جدید ساخته میشه
+        midnight = IRAN_TZ.localize(datetime.combine(now.date() + timedelta(days=1), dtime()))
+        delay = min(delay, (midnight - now).total_seconds())
+        return max(0.0, delay)
+
+    def _schedule_retry(self, task_id: str, retry_at: datetime):
+        self._next_retry[task_id] = retry_at
+        heapq.heappush(self._heap, (retry_at, task_id))
+
+    def _retry_later(self, task_id: str, now: datetime):
+        n = self._attempts[task_id] = self._attempts.get(task_id, 0) + 1
+        if n > DEADLINE_MAX_RETRIES:
+            log_error(f"Deadline timer: giving up on {task_id} after {n - 1} retries")
+            return
+        delay = min(DEADLINE_RETRY_SEC * 2 ** (n - 1), DEADLINE_RESCAN_SEC)
+        self._schedule_retry(task_id, now + timedelta(seconds=delay))
+
+    async def _run(self):
+        while True:
+            try:
+                await self._refresh(datetime.now(IRAN_TZ))
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self._sleep_for(datetime.now(IRAN_TZ)))
+                except asyncio.TimeoutError:
+                    pass
+                if self._wake.is_set():
+                    self._wake.clear()
+                    continue
+
+                now = datetime.now(IRAN_TZ)
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap)[1])
+                if not due:
+                    continue
+
+                result = await fire_deadline_reminders(due, mark_only=self._mark_only)
+                if result is None:
+                    # lease دست worker دیگریه؛ دوباره امتحان می‌کنیم (ledger جلوی تکرار رو می‌گیره)
+                    retry_at = now + timedelta(seconds=DEADLINE_RETRY_SEC)
+                    for task_id in due:
+                        self._schedule_retry(task_id, retry_at)
+                    continue
+
+                self._mark_only.difference_update(result["sent"])
+                for task_id in result["sent"]:
+                    self._next_retry.pop(task_id, None)
+                # ارسال‌شده‌های ثبت‌نشده دوباره فرستاده نمیشن، فقط ثبتشون تکرار میشه
+                self._mark_only.update(result["unpersisted"])
+                for task_id in result["failed"] + result["unpersisted"]:
+                    self._retry_later(task_id, now)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_error(f"Deadline timer ERROR: {e}")
+                await asyncio.sleep(DEADLINE_RETRY_SEC)
+
+
+deadline_timer = DeadlineTimer()
+
+
+def start_deadline_timer():
+    if not DEADLINE_TIMER_ENABLED:
+        return
+    deadline_timer.start()
+
+
+async def stop_deadline_timer():
+    await deadline_timer.stop()
@@ -1,7 +1,7 @@
 # app/scheduler/job.py
 # -*- coding: utf-8 -*-
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 import asyncio
 import os
@@ -9,20 +9,23 @@ import os
 from core.members import get_members_by_team
 from core.tasks import (
     load_tasks,
-    update_task_reminder,
-    get_tasks_today,
-    get_tasks_next_7_days,   # <-- جدید
+    load_task_index,
+    ReminderLedger,
     group_tasks_by_date,
     format_task_block,
+    normalize_team,
     parse_time_hhmm,
 )
-from core.messages import get_random_message
+from core.messages import get_random_message, get_message_template
+from core.sheets import invalidate
+from core.lease import lease, claim_run, release_run
 from bot.helpers import send_message, send_buttons
 from core.logging import log_error, log_info
 
 IRAN_TZ = pytz.timezone("Asia/Tehran")
 TEAM_NAMES = ["Production", "AI Production", "Digital"]
 
+# داخل پروسه با asyncio.Lock، بین workerها/پروسه‌ها با lease (core.lease)
 reminder_lock = asyncio.Lock()
 
 # ---- تنظیمات ارسال رندوم‌ها ساعت 9 ----
@@ -38,55 +41,148 @@ def task_action_buttons(task_id: str):
         [{"text": "تحویل ندادم ⏰", "callback_data": f"notyet|{task_id}"}],
     ]
 
-async def run_daily_jobs():
+async def _send_logged(job: str, chat_id, text: str) -> bool:
+    try:
+        return bool(await send_message(chat_id, text))
+    except Exception as e:
+        log_error(f"{job} job error {chat_id}: {e}")
+        return False
+
+def _member_name(u: dict) -> str:
+    return u.get("customname") or u.get("name") or "رفیق"
+
+def _daily_digest(tasks: list) -> str:
+    return "\n\n".join(format_task_block(t) for t in tasks)
+
+def _weekly_digest(tasks: list) -> str:
+    lines = []
+    for d, items in group_tasks_by_date(tasks):
+        day = items[0].get("day_fa", "")
+        date_fa = items[0].get("date_fa", "")
+        lines.append(f"🗓️ <b>{day} | {date_fa}</b>")
+        for t in items:
+            lines.append(f"• {t['title']}" + (f" ⏰ {t['time']}" if t.get("time") else ""))
+        lines.append("")
+    return "\n".join(lines).strip()
+
+async def _plan_daily():
     """
-    هر روز 08:30: لیست امروز (بدون دکمه یا می‌تونی با دکمه هم کنی)
+    تسک‌ها یک بار از ایندکس تیم/تاریخ خونده می‌شن، متن هر تیم یک بار ساخته میشه
+    و فقط سلام اول پیام برای هر نفر شخصی‌سازی میشه.
+    خروجی: لیست (chat_id, text)
     """
-    for team in TEAM_NAMES:
-        members = await get_members_by_team(team)
-        for u in members:
-            try:
-                tasks = await get_tasks_today(team)
-                name = u.get("customname") or u.get("name") or "رفیق"
+    index = await load_task_index()
+    today = datetime.now(IRAN_TZ).date()
 
-                if not tasks:
-                    await send_message(u["chat_id"], f"☀️ صبح بخیر <b>{name}</b>!\n✅ امروز تسکی نداری.")
-                    continue
-
-                blocks = [f"☀️ صبح بخیر <b>{name}</b>!\n📌 کارهای امروزت ({len(tasks)}):\n"]
-                for t in tasks:
-                    blocks.append(format_task_block(t))
-                    blocks.append("")
-                await send_message(u["chat_id"], "\n".join(blocks).strip())
-            except Exception as e:
-                log_error(f"Daily job error {u.get('chat_id')}: {e}")
+    plan = []
+    for team in TEAM_NAMES:
+        team_tasks = [t for t in index.range(normalize_team(team), today, today) if not t["done"]]
+        digest = _daily_digest(team_tasks) if team_tasks else ""
+        for u in await get_members_by_team(team):
+            name = _member_name(u)
+            if not team_tasks:
+                text = f"☀️ صبح بخیر <b>{name}</b>!\n✅ امروز تسکی نداری."
+            else:
+                text = f"☀️ صبح بخیر <b>{name}</b>!\n📌 کارهای امروزت ({len(team_tasks)}):\n\n{digest}"
+            plan.append((u["chat_id"], text))
+    return plan
+
+async def _plan_weekly():
+    index = await load_task_index()
+    start = datetime.now(IRAN_TZ).date()
+    end = start + timedelta(days=6)  # 7 روز شامل امروز
+
+    plan = []
+    for team in TEAM_NAMES:
+        team_tasks = [t for t in index.range(normalize_team(team), start, end) if not t["done"]]
+        digest = _weekly_digest(team_tasks) if team_tasks else ""
+        for u in await get_members_by_team(team):
+            name = _member_name(u)
+            if not team_tasks:
+                text = f"📅 <b>{name}</b>\nبرای ۷ روز آینده تسکی نداری 👌"
+            else:
+                text = f"📅 <b>{name}</b>\n🗂️ برنامه ۷ روز آینده ({len(team_tasks)} تسک):\n\n{digest}"
+            plan.append((u["chat_id"], text))
+    return plan
+
+async def _execute(job: str, plan: list) -> int:
+    # ارسال همزمان؛ صف ارسال (bot.helpers) rate limit رو رعایت می‌کنه
+    results = await asyncio.gather(*[_send_logged(job, chat_id, text) for chat_id, text in plan])
+    return sum(results)
+
+async def _run_once(job: str, plan_fn, force: bool) -> bool:
+    """
+    فقط یک worker اجرا می‌کنه (lease) و برای هر تاریخ فقط یکبار (claim_run)؛
+    force برای اجرای دستی دوباره در همان روز.
+    خروجی: True اگر این worker ارسال کرد
+    """
+    async with lease(job.lower()) as held:
+        if not held:
+            log_info(f"{job} job: lease held by another worker, skipping")
+            return False
+        run_key = datetime.now(IRAN_TZ).strftime("%Y-%m-%d")
+        if not force and not await claim_run(job.lower(), run_key):
+            return False
+        # اگر plan خطا داد یا هیچ پیامی نرسید (مثلا شیت members در دسترس نبود)، روز مصرف نمیشه
+        sent = 0
+        try:
+            sent = await _execute(job, await plan_fn())
+        finally:
+            if not sent:
+                log_error(f"{job} job: nothing sent for {run_key}, will retry on next trigger")
+                if not force:
+                    await release_run(job.lower(), run_key)
+        return bool(sent)
+
+async def run_daily_jobs(force: bool = False):
+    """
+    هر روز 08:30: لیست امروز (بدون دکمه یا می‌تونی با دکمه هم کنی)
+    """
+    return await _run_once("Daily", _plan_daily, force)
 
-async def run_weekly_jobs():
+async def run_weekly_jobs(force: bool = False):
     """
     هر شنبه ساعت دلخواه: برنامه ۷ روز آینده از همان روز
     """
-    for team in TEAM_NAMES:
-        members = await get_members_by_team(team)
-        for u in members:
-            try:
-                tasks = await get_tasks_next_7_days(team)  # از امروز تا ۷ روز آینده
-                name = u.get("customname") or u.get("name") or "رفیق"
-
-                if not tasks:
-                    await send_message(u["chat_id"], f"📅 <b>{name}</b>\nبرای ۷ روز آینده تسکی نداری 👌")
-                    continue
-
-                lines = [f"📅 <b>{name}</b>\n🗂️ برنامه ۷ روز آینده ({len(tasks)} تسک):\n"]
-                for d, items in group_tasks_by_date(tasks):
-                    day = items[0].get("day_fa", "")
-                    date_fa = items[0].get("date_fa", "")
-                    lines.append(f"🗓️ <b>{day} | {date_fa}</b>")
-                    for t in items:
-                        lines.append(f"• {t['title']}" + (f" ⏰ {t['time']}" if t.get("time") else ""))
-                    lines.append("")
-                await send_message(u["chat_id"], "\n".join(lines).strip())
-            except Exception as e:
-                log_error(f"Weekly job error {u.get('chat_id')}: {e}")
+    return await _run_once("Weekly", _plan_weekly, force)
+
+async def _remind_team(t: dict, reminder_type: str, delay: int) -> bool:
+    """ارسال ریمایندر یک تسک به اعضای تیمش (با دکمه)؛ خروجی: آیا چیزی ارسال شد"""
+    # اعضای تیم مربوطه
+    team_members = await get_members_by_team(t["team"])
+    if not team_members:
+        log_error(f"No members found for team={t.get('team')} task={t.get('task_id')}")
+        return False
+
+    # یک قالب برای همه‌ی اعضای تیم؛ فقط {name} برای هر نفر جایگذاری میشه
+    tpl = await get_message_template(reminder_type)
+    if tpl is None:
+        texts = ["—"] * len(team_members)
+    else:
+        texts = tpl.render_many(
+            {
+                "title": t.get("title", ""),
+                "date_fa": t.get("date_fa", ""),
+                "days": abs(delay) if delay < 0 else delay,
+                "time": t.get("time", ""),
+            },
+            [{"name": _member_name(u)} for u in team_members],
+        )
+
+    extra = ""
+    if t.get("type"):
+        extra += f"\n🧩 <b>سبک محتوا:</b> {t['type']}"
+    if t.get("comment"):
+        extra += f"\n💬 <b>توضیحات بیشتر:</b> {t['comment']}"
+
+    buttons = task_action_buttons(t["task_id"])
+    sends = []
+    for u, msg in zip(team_members, texts):
+        # ✅ همه‌ی ریمایندرها (deadline + 2day + overها) دکمه دارند
+        sends.append(send_buttons(u["chat_id"], msg + extra, buttons))
+
+    # فقط وقتی حداقل یک ارسال واقعا موفق بوده، یادآور ثبت میشه
+    return any(await asyncio.gather(*sends))
 
 async def check_reminders():
     """
@@ -94,7 +190,13 @@ async def check_reminders():
     - ددلاین با ساعت: هر وقت از زمانش رد شد (با اجرای دوره‌ای reminders)
     - overها هم دکمه دارند
     """
-    async with reminder_lock:
+    async with reminder_lock, lease("reminders") as held:
+        if not held:
+            log_info("Reminders: lease held by another worker, skipping")
+            return False
+        if held.taken_over:
+            # آخرین بار worker دیگه reminders رو نوشته؛ کش محلی Tasks ممکنه کهنه باشه
+            invalidate("Tasks")
         tasks = await load_tasks()
 
         now = datetime.now(IRAN_TZ)
@@ -104,13 +206,17 @@ async def check_reminders():
         admins = await get_members_by_team("ALL")
         morning_ok = in_morning_window(now)
 
+        # ریمایندرها در حافظه خونده/ثبت میشن و آخر کار با یک batch_update نوشته میشن
+        ledger = ReminderLedger(await load_task_index())
+        written = []  # (label, task_id)
+
         for t in tasks:
             if t.get("done"):
                 continue
 
             try:
                 delay = int(t.get("delay_days", 0))
-                reminders = t.get("reminders") or {}
+                reminders = ledger.get(t["task_id"])
 
                 reminder_type = None
                 reminder_key = None
@@ -182,51 +288,79 @@ async def check_reminders():
                     if t.get("comment"):
                         msg += f"\n💬 <b>توضیحات بیشتر:</b> {t['comment']}"
 
-                    for a in admins:
-                        await send_message(a["chat_id"], msg)
-
-                    ok = await update_task_reminder(t["task_id"], "escalated", today_str)
-                    log_info(f"Sent escalated for {t['task_id']} ok={ok}")
-                    continue
+                    await asyncio.gather(*[send_message(a["chat_id"], msg) for a in admins])
 
-                # اعضای تیم مربوطه
-                team_members = await get_members_by_team(t["team"])
-                if not team_members:
-                    log_error(f"No members found for team={t.get('team')} task={t.get('task_id')}")
+                    ledger.mark(t["task_id"], "escalated", today_str)
+                    written.append(("escalated", t["task_id"]))
                     continue
 
-                sent = False
-                for u in team_members:
-                    name = u.get("customname") or u.get("name") or "رفیق"
-
-                    msg = await get_random_message(reminder_type, **{
-                        "name": name,
-                        "title": t.get("title", ""),
-                        "date_fa": t.get("date_fa", ""),
-                        "days": abs(delay) if delay < 0 else delay,
-                        "time": t.get("time", ""),
-                    })
-
-                    if t.get("type"):
-                        msg += f"\n🧩 <b>سبک محتوا:</b> {t['type']}"
-                    if t.get("comment"):
-                        msg += f"\n💬 <b>توضیحات بیشتر:</b> {t['comment']}"
-
-                    # ✅ همه‌ی ریمایندرها (deadline + 2day + overها) دکمه دارند
-                    await send_buttons(u["chat_id"], msg, task_action_buttons(t["task_id"]))
-                    sent = True
+                sent = await _remind_team(t, reminder_type, delay)
 
                 # ثبت جلوگیری از تکرار
                 if sent:
                     if delay == 0 and (t.get("time") or ""):
-                        ok = await update_task_reminder(t["task_id"], "deadline_time", f"{today_str} {t.get('time','')}")
-                        log_info(f"Sent deadline_time for {t['task_id']} ok={ok}")
+                        key, value = "deadline_time", f"{today_str} {t.get('time','')}"
                     elif delay == 0:
-                        ok = await update_task_reminder(t["task_id"], "deadline_morning", today_str)
-                        log_info(f"Sent deadline_morning for {t['task_id']} ok={ok}")
+                        key, value = "deadline_morning", today_str
                     else:
-                        ok = await update_task_reminder(t["task_id"], reminder_type, today_str)
-                        log_info(f"Sent {reminder_type} for {t['task_id']} ok={ok}")
+                        key, value = reminder_type, today_str
+                    ledger.mark(t["task_id"], key, value)
+                    written.append((key, t["task_id"]))
 
             except Exception as e:
                 log_error(f"Reminder error task={t.get('task_id')}: {e}")
+
+        results = await ledger.persist()
+        for key, task_id in written:
+            log_info(f"Sent {key} for {task_id} ok={results.get(task_id, False)}")
+        return True
+
+async def fire_deadline_reminders(task_ids: list, mark_only=()):
+    """
+    فقط ددلاین‌های ساعت‌دار همین تسک‌ها (برای scheduler.deadlines)؛ همان منطق و همان ثبت check_reminders.
+    mark_only: تسک‌هایی که قبلا ارسال شدن ولی ثبتشون ناموفق بود؛ فقط دوباره ثبت میشن.
+    خروجی: None اگر lease دست worker دیگری بود، وگرنه
+        {"sent": ارسال و ثبت شد, "unpersisted": ارسال شد ولی ثبت نشد, "failed": سررسید بود ولی ارسال نشد}
+    """
+    async with reminder_lock, lease("reminders") as held:
+        if not held:
+            log_info("Deadline reminders: lease held by another worker, skipping")
+            return None
+        if held.taken_over:
+            invalidate("Tasks")
+        index = await load_task_index()
+
+        now = datetime.now(IRAN_TZ)
+        today_str = now.strftime("%Y-%m-%d")
+        current_hm = (now.hour, now.minute)
+        ledger = ReminderLedger(index)
+        fired = []
+        failed = []
+
+        for task_id in task_ids:
+            t = index.get(task_id)
+            if not t or t.get("done") or t["date_en"] != now.date():
+                continue
+            parsed = parse_time_hhmm(t.get("time") or "")
+            if not parsed or current_hm < parsed:
+                continue
+            if str(ledger.get(task_id).get("deadline_time", "")).startswith(today_str):
+                continue
+            try:
+                if task_id in mark_only or await _remind_team(t, "deadline", 0):
+                    ledger.mark(task_id, "deadline_time", f"{today_str} {t.get('time','')}")
+                    fired.append(task_id)
+                else:
+                    failed.append(task_id)
+            except Exception as e:
+                log_error(f"Deadline reminder error task={task_id}: {e}")
+                failed.append(task_id)
+
+        results = await ledger.persist()
+        for task_id in fired:
+            log_info(f"Sent deadline_time for {task_id} ok={results.get(task_id, False)}")
+        return {
+            "sent": [tid for tid in fired if results.get(tid)],
+            "unpersisted": [tid for tid in fired if not results.get(tid)],
+            "failed": failed,
+        }
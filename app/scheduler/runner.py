@@ -0,0 +1,112 @@
+# app/scheduler/runner.py
+# -*- coding: utf-8 -*-
+
+import os
+from datetime import datetime, timedelta
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.triggers.date import DateTrigger
+
+from scheduler.job import IRAN_TZ, MORNING_HOUR, run_daily_jobs, run_weekly_jobs, check_reminders
+from scheduler.deadlines import DEADLINE_TIMER_ENABLED
+from core.logging import log_error, log_info
+
+# ---- زمان‌بندی داخلی (به جای کرون بیرونی)؛ endpointهای /run/* همچنان کار می‌کنن ----
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1").strip() not in ("0", "false", "no", "")
+DAILY_AT = os.getenv("DAILY_AT", "08:30")
+WEEKLY_DAY = os.getenv("WEEKLY_DAY", "sat")
+WEEKLY_AT = os.getenv("WEEKLY_AT", "08:30")
+REMINDER_INTERVAL_MIN = int(os.getenv("REMINDER_INTERVAL_MIN", "5"))
+REMINDER_FALLBACK_MIN = int(os.getenv("REMINDER_FALLBACK_MIN", "30"))
+# اگر اجرا به خاطر شلوغی/خواب سرویس دیر شد، تا این مدت هنوز اجرا میشه (چندتا عقب‌افتاده => یکی)
+MISFIRE_GRACE_SEC = int(os.getenv("SCHEDULER_MISFIRE_GRACE_SEC", "3600"))
+
+_WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+_scheduler: AsyncIOScheduler | None = None
+
+
+def _hm(value: str):
+    h, m = value.split(":", 1)
+    return int(h), int(m)
+
+
+def _guarded(name: str, fn):
+    async def run():
+        try:
+            await fn()
+        except Exception as e:
+            log_error(f"Scheduled {name} ERROR: {e}")
+    run.__name__ = f"scheduled_{name}"
+    return run
+
+
+def _catch_up(scheduler: AsyncIOScheduler, now: datetime):
+    """
+    بعد از restart (مثلا deploy یا بیدار شدن سرویس) اگر job امروز در همین بازه‌ی grace رد شده،
+    یکبار اجرا میشه؛ claim_run جلوی اجرای دوباره رو می‌گیره.
+    """
+    dh, dm = _hm(DAILY_AT)
+    due = now.replace(hour=dh, minute=dm, second=0, microsecond=0)
+    if timedelta(0) < now - due <= timedelta(seconds=MISFIRE_GRACE_SEC):
+        scheduler.add_job(_guarded("daily", run_daily_jobs), DateTrigger(now, timezone=IRAN_TZ), id="daily_catchup")
+
+    wh, wm = _hm(WEEKLY_AT)
+    due = now.replace(hour=wh, minute=wm, second=0, microsecond=0)
+    if _WEEKDAYS[now.weekday()] == WEEKLY_DAY.lower()[:3] and timedelta(0) < now - due <= timedelta(seconds=MISFIRE_GRACE_SEC):
+        scheduler.add_job(_guarded("weekly", run_weekly_jobs), DateTrigger(now, timezone=IRAN_TZ), id="weekly_catchup")
+
+
+def start_scheduler():
+    global _scheduler
+    if not SCHEDULER_ENABLED:
+        log_info("Scheduler disabled (SCHEDULER_ENABLED=0)")
+        return None
+    if _scheduler is not None:
+        return _scheduler
+
+    scheduler = AsyncIOScheduler(
+        timezone=IRAN_TZ,
+        job_defaults={
+            "coalesce": True,
+            "max_instances": 1,
+            "misfire_grace_time": MISFIRE_GRACE_SEC,
+        },
+    )
+    dh, dm = _hm(DAILY_AT)
+    wh, wm = _hm(WEEKLY_AT)
+    scheduler.add_job(_guarded("daily", run_daily_jobs), CronTrigger(hour=dh, minute=dm, timezone=IRAN_TZ), id="daily")
+    scheduler.add_job(
+        _guarded("weekly", run_weekly_jobs),
+        CronTrigger(day_of_week=WEEKLY_DAY, hour=wh, minute=wm, timezone=IRAN_TZ),
+        id="weekly",
+    )
+    # ریمایندرها: یک اجرای قطعی داخل پنجره‌ی صبح برای رندوم‌ها + اسکن دوره‌ای؛
+    # وقتی ددلاین‌های ساعت‌دار با scheduler.deadlines دقیق اجرا میشن، اسکن فقط پشتیبان است و کم‌تکرار
+    interval = REMINDER_FALLBACK_MIN if DEADLINE_TIMER_ENABLED else REMINDER_INTERVAL_MIN
+    scheduler.add_job(
+        _guarded("reminders", check_reminders),
+        IntervalTrigger(minutes=interval, timezone=IRAN_TZ),
+        id="reminders",
+    )
+    scheduler.add_job(
+        _guarded("morning_reminders", check_reminders),
+        CronTrigger(hour=MORNING_HOUR, minute=1, timezone=IRAN_TZ),
+        id="morning_reminders",
+        misfire_grace_time=300,  # بعد از پنجره‌ی صبح اجرا فایده نداره
+    )
+    _catch_up(scheduler, datetime.now(IRAN_TZ))
+
+    scheduler.start()
+    _scheduler = scheduler
+    log_info(f"Scheduler started: {[j.id for j in scheduler.get_jobs()]}")
+    return scheduler
+
+
+def stop_scheduler():
+    global _scheduler
+    if _scheduler is not None:
+        # jobهای در حال اجرا کنسل نمیشن؛ lease/claim_run تکرار رو کنترل می‌کنن
+        _scheduler.shutdown(wait=False)
+        _scheduler = None